@@ -6,44 +6,64 @@ Flask API for managing health programs and patient records
 # ======================
 # 1. SETUP AND CONFIG
 # ======================
-from flask import Flask, request, jsonify
+from flask import (Blueprint, Flask, Response, current_app, g, has_request_context, request,
+                   jsonify, stream_with_context)
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from dotenv import load_dotenv
+from datetime import date
 from functools import wraps
+from itertools import islice
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from search import MIN_INDEXED_LENGTH, escape_like, get_search_index
+from stats import get_enrollment_stats
+from cache import make_cache
+from metrics import make_metrics
+from sqlitefile import resolve_sqlite_uri
+import ratelimit  # noqa: F401 - registers the sqlite:/// rate limit storage
+from urllib.parse import urlencode
+import click
+import csv
+import hashlib
+import io
+import json
 import os
+import time
+import zlib
 
 # Load environment variables
 load_dotenv()
 
-# Initialize Flask app
-app = Flask(__name__)
+# Extensions are created unbound and attached to an app in create_app()
+db = SQLAlchemy()
 
-# Configure CORS (Cross-Origin Resource Sharing)
-CORS(app, resources={
-    r"/api/*": {
-        "origins": ["http://localhost:8000"],  # Frontend URL
-        "methods": ["GET", "POST", "DELETE"],
-        "allow_headers": ["Content-Type", "X-API-KEY"]
-    }
-})
-
-# Rate limiting configuration
-limiter = Limiter(
-    app=app,
-    key_func=get_remote_address,
-    storage_uri="memory://",
-    default_limits=["200 per day", "50 per hour"]
-)
+# Each app gets its own Limiter in create_app(), so apps never share storage
+DEFAULT_RATE_LIMITS = ["200 per day", "50 per hour"]
+api = Blueprint('api', __name__, cli_group=None)
 
-# Database configuration
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///health_info.db')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['API_KEYS'] = os.getenv('API_KEYS', '').split(',')  # Multiple keys supported
-
-db = SQLAlchemy(app)
+# Settings applied by create_app('production') for multi-worker serving
+PRODUCTION_CONFIG = {
+    # Each worker keeps a small pool; threads beyond it wait instead of opening more
+    'SQLALCHEMY_ENGINE_OPTIONS': {
+        'pool_size': int(os.getenv('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 5)),
+        'pool_timeout': 30,
+        'pool_recycle': 1800,
+        'pool_pre_ping': True,
+    },
+    # Applied to every new SQLite connection; WAL lets readers run alongside a writer
+    'SQLITE_PRAGMAS': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -64000,       # KiB (64 MB) per connection
+        'mmap_size': 268435456,     # 256 MB
+        'busy_timeout': 5000,       # ms to wait on a locked database before failing
+        'temp_store': 'MEMORY',
+    },
+}
 
 # ======================
 # 2. DATABASE MODELS
@@ -66,6 +86,38 @@ client_program = db.Table('client_program',
     db.Column('program_id', db.Integer, db.ForeignKey('health_program.id'), primary_key=True)
 )
 
+# Keep the client search index (see search.py) in step with the schema and rows
+@event.listens_for(db.metadata, 'after_create')
+def create_search_index(target, connection, **kw):
+    get_search_index(connection).create(connection)
+
+@event.listens_for(db.metadata, 'before_drop')
+def drop_search_index(target, connection, **kw):
+    get_search_index(connection).drop(connection)
+
+# Enrollment summary tables (see stats.py) follow client_program through triggers
+@event.listens_for(db.metadata, 'after_create')
+def create_enrollment_stats(target, connection, **kw):
+    get_enrollment_stats(connection).create(connection)
+
+@event.listens_for(db.metadata, 'before_drop')
+def drop_enrollment_stats(target, connection, **kw):
+    get_enrollment_stats(connection).drop(connection)
+
+@event.listens_for(Client, 'after_insert')
+def index_client(mapper, connection, client):
+    get_search_index(connection).index(connection, [(client.id, client.name, client.email)])
+
+@event.listens_for(Client, 'after_update')
+def reindex_client(mapper, connection, client):
+    index = get_search_index(connection)
+    index.unindex(connection, [client.id])
+    index.index(connection, [(client.id, client.name, client.email)])
+
+@event.listens_for(Client, 'after_delete')
+def unindex_client(mapper, connection, client):
+    get_search_index(connection).unindex(connection, [client.id])
+
 # ======================
 # 3. HELPER FUNCTIONS
 # ======================
@@ -74,16 +126,492 @@ def require_api_key(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
         api_key = request.headers.get('X-API-KEY')
-        if api_key not in app.config['API_KEYS']:
+        if api_key not in current_app.config['API_KEYS']:
             return jsonify({"error": "Unauthorized"}), 401
         return func(*args, **kwargs)
     return wrapper
 
+def get_response_cache():
+    """The response cache configured for the current app"""
+    return current_app.extensions['response_cache']
+
+def rate_limit(limit, methods=None):
+    """Mark a view for `limit`; create_app() enforces it with the app's own Limiter"""
+    def decorator(func):
+        func.rate_limit = (limit, methods)
+        return func
+    return decorator
+
+def rate_limit_exempt(func):
+    """Mark a view as exempt from every rate limit, including the defaults"""
+    func.rate_limit_exempt = True
+    return func
+
+def cached_response(namespace):
+    """
+    Decorator serving GET responses from response_cache with a strong ETag.
+    Writes call response_cache.invalidate(namespace) for the data they change.
+    Streamed and non-200 responses are passed through uncached.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET':
+                return func(*args, **kwargs)
+            key = f"{namespace}:{request.path}?{urlencode(sorted(request.args.items(multi=True)))}"
+            entry = get_response_cache().get(key)
+            if entry is None:
+                # Read before rendering: a write landing meanwhile bumps it and blocks the store
+                generation = get_response_cache().generation(namespace)
+                response = current_app.make_response(func(*args, **kwargs))
+                if response.status_code != 200 or response.is_streamed:
+                    return response
+                body = response.get_data()
+                entry = (hashlib.sha256(body).hexdigest(), body, response.mimetype)
+                get_response_cache().set(namespace, key, entry, generation)
+
+            etag, body, mimetype = entry
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+            else:
+                response = Response(body, mimetype=mimetype)
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'no-cache'  # Always revalidate with the ETag
+            return response
+        return wrapper
+    return decorator
+
+def is_id_list(values):
+    """True for a JSON list of integer ids; JSON booleans are Python ints but not ids"""
+    return isinstance(values, list) and all(
+        isinstance(v, int) and not isinstance(v, bool) for v in values)
+
+def flag_arg(name):
+    """Read a boolean query string flag such as ?stream=1"""
+    return request.args.get(name, '').lower() in ('1', 'true', 'yes')
+
+def get_page_args(stream=False):
+    """Read ?after and ?limit keyset pagination arguments (raises ValueError)"""
+    max_limit = current_app.config['CLIENT_MAX_STREAM_SIZE' if stream else 'CLIENT_MAX_PAGE_SIZE']
+    try:
+        after = int(request.args.get('after', 0))
+        limit = int(request.args.get('limit', current_app.config['CLIENT_PAGE_SIZE']))
+    except ValueError:
+        raise ValueError("'after' and 'limit' must be integers")
+    if after < 0:
+        raise ValueError("'after' must be a non-negative client id")
+    if not 1 <= limit <= max_limit:
+        raise ValueError(f"'limit' must be between 1 and {max_limit}")
+    return after, limit
+
+def load_client_programs(client_ids):
+    """Fetch enrollments for many clients in one query, keyed by client id"""
+    programs = {cid: [] for cid in client_ids}
+    if not client_ids:
+        return programs
+    rows = (db.session.query(client_program.c.client_id, HealthProgram.id, HealthProgram.name)
+            .join(HealthProgram, HealthProgram.id == client_program.c.program_id)
+            .filter(client_program.c.client_id.in_(client_ids))
+            .order_by(client_program.c.client_id, HealthProgram.id)
+            .all())
+    for client_id, program_id, program_name in rows:
+        programs[client_id].append({"id": program_id, "name": program_name})
+    return programs
+
+def serialize_clients(rows):
+    """Turn (id, name, email) rows into client dicts, batch-loading their programs"""
+    programs = load_client_programs([r.id for r in rows])
+    return [{
+        "id": r.id,
+        "name": r.name,
+        "email": r.email,
+        "programs": programs[r.id]
+    } for r in rows]
+
+def client_page_batches(query, after, limit, batch_size):
+    """
+    Yield (clients, next_cursor) batches of a keyset page ordered by client id.
+    Each batch costs two queries (clients + their enrollments); next_cursor is
+    only meaningful on the last batch and is None once the listing is exhausted.
+    """
+    remaining = limit
+    while remaining > 0:
+        size = min(batch_size, remaining)
+        last_batch = size == remaining
+        # Fetch one extra row on the last batch to know whether a next page exists
+        rows = (query.with_entities(Client.id, Client.name, Client.email)
+                .filter(Client.id > after)
+                .order_by(Client.id)
+                .limit(size + 1 if last_batch else size)
+                .all())
+        next_cursor = None
+        if last_batch and len(rows) > size:
+            rows = rows[:size]
+            next_cursor = rows[-1].id
+        yield serialize_clients(rows), next_cursor
+        if len(rows) < size:
+            return
+        after = rows[-1].id
+        remaining -= size
+
+def client_page_response(query):
+    """Build a paginated client listing, streamed when ?stream=1 is passed"""
+    stream = flag_arg('stream')
+    try:
+        after, limit = get_page_args(stream)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if not stream:
+        clients, next_cursor = next(client_page_batches(query, after, limit, limit))
+        return jsonify({"clients": clients, "next": next_cursor})
+
+    def generate():
+        yield '{"clients": ['
+        first = True
+        next_cursor = None
+        batches = client_page_batches(query, after, limit, current_app.config['CLIENT_STREAM_BATCH_SIZE'])
+        for clients, next_cursor in batches:
+            for c in clients:
+                yield ('' if first else ',') + json.dumps(c)
+                first = False
+        yield '], "next": ' + json.dumps(next_cursor) + '}'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+# Export formats and their content types
+EXPORT_FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+def iter_export_clients(connection, program_id=None):
+    """
+    Yield one dict per client with their programs, from a single streamed join
+    over client, client_program and health_program. Rows arrive ordered by
+    client id, so only the client being assembled is held in memory.
+    """
+    stmt = (db.select(Client.id, Client.name, Client.email,
+                      HealthProgram.id.label('program_id'), HealthProgram.name.label('program_name'))
+            .select_from(Client)
+            .outerjoin(client_program, client_program.c.client_id == Client.id)
+            .outerjoin(HealthProgram, HealthProgram.id == client_program.c.program_id)
+            .order_by(Client.id, HealthProgram.id))
+    if program_id is not None:
+        stmt = stmt.where(Client.id.in_(db.select(client_program.c.client_id)
+                                        .where(client_program.c.program_id == program_id)))
+    result = connection.execution_options(
+        stream_results=True, yield_per=current_app.config['EXPORT_YIELD_PER']).execute(stmt)
+
+    current = None
+    for row in result:
+        if current is None or current['id'] != row.id:
+            if current is not None:
+                yield current
+            current = {"id": row.id, "name": row.name, "email": row.email, "programs": []}
+        if row.program_id is not None:
+            current['programs'].append({"id": row.program_id, "name": row.program_name})
+    if current is not None:
+        yield current
+
+def export_lines(clients, fmt):
+    """Encode client dicts as NDJSON lines or CSV rows"""
+    if fmt == 'ndjson':
+        for c in clients:
+            yield json.dumps(c) + '\n'
+        return
+    # Same columns as the bulk import, plus the id and program names
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(['id', 'name', 'email', 'programs', 'program_names'])
+    for c in clients:
+        writer.writerow([c['id'], c['name'], c['email'],
+                         ';'.join(str(p['id']) for p in c['programs']),
+                         ';'.join(p['name'] for p in c['programs'])])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+def export_chunks(connection, fmt, program_id=None, compress=False):
+    """Yield the export as byte chunks of roughly EXPORT_CHUNK_SIZE, optionally gzipped"""
+    chunk_size = current_app.config['EXPORT_CHUNK_SIZE']
+    gzip = zlib.compressobj(wbits=31) if compress else None  # wbits=31 writes a gzip header
+    pending, size = [], 0
+    for line in export_lines(iter_export_clients(connection, program_id), fmt):
+        data = line.encode('utf-8')
+        pending.append(gzip.compress(data) if gzip else data)
+        size += len(pending[-1])
+        if size >= chunk_size:
+            yield b''.join(pending)
+            pending, size = [], 0
+    if gzip:
+        pending.append(gzip.flush())
+    if pending:
+        yield b''.join(pending)
+
+class DecodedLines:
+    """
+    Iterate a binary stream as UTF-8 text lines. A line that is not valid
+    UTF-8 raises UnicodeDecodeError from next() without ending the iteration,
+    so callers can report it and carry on. A leading byte order mark, as
+    written by Excel, is dropped. `line_number` counts every line read,
+    undecodable ones included.
+    """
+
+    def __init__(self, stream):
+        self.lines = iter(io.BufferedReader(stream))
+        self.encoding = 'utf-8-sig'  # Only the first line can start with a BOM
+        self.line_number = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = next(self.lines)
+        self.line_number += 1
+        encoding, self.encoding = self.encoding, 'utf-8'
+        return line.decode(encoding)
+
+def iter_bulk_records(stream, mimetype):
+    """
+    Yield (line_number, record) pairs from an NDJSON or CSV upload without
+    reading it all into memory. `line_number` is the file line the row starts
+    on, header included. `record` is a dict, or an error string when the row
+    cannot be decoded or parsed.
+    """
+    lines = DecodedLines(stream)
+    if mimetype == 'text/csv':
+        # Columns: name,email,programs where programs is a ';'-separated id list.
+        # Lines are counted by DecodedLines: reader.line_num skips undecodable ones
+        reader = csv.reader(lines)
+        try:
+            header = next(reader, [])
+        except (UnicodeDecodeError, csv.Error) as e:
+            yield 1, f"Unreadable header row: {e}"
+            return
+        while True:
+            line_number = lines.line_number + 1  # Quoted fields can span several lines
+            try:
+                row = next(reader)
+            except StopIteration:
+                return
+            except UnicodeDecodeError:
+                yield lines.line_number, "Row is not valid UTF-8"
+                continue
+            except csv.Error as e:
+                yield line_number, f"Malformed CSV row: {e}"
+                continue
+            if not row:
+                continue
+            record = dict(zip(header, row))
+            programs = (record.get('programs') or '').strip()
+            # Only plain digit strings become ids; anything else fails validation as is
+            ids = [p.strip() for p in programs.split(';')] if programs else []
+            record['programs'] = [int(p) if p.isascii() and p.isdigit() else p for p in ids]
+            yield line_number, record
+    else:
+        while True:
+            try:
+                line = next(lines)
+            except StopIteration:
+                return
+            except UnicodeDecodeError:
+                yield lines.line_number, "Row is not valid UTF-8"
+                continue
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                yield lines.line_number, "Invalid JSON"
+                continue
+            yield lines.line_number, record if isinstance(record, dict) else "Expected a JSON object"
+
+def validate_bulk_record(record):
+    """Normalise one bulk row to (name, email, program_ids) (raises ValueError)"""
+    if isinstance(record, str):
+        raise ValueError(record)
+    name, email = record.get('name'), record.get('email')
+    if not isinstance(name, str) or not isinstance(email, str) or not name or not email:
+        raise ValueError("Name and email are required")
+    programs = record.get('programs') or []
+    if not is_id_list(programs):
+        raise ValueError("'programs' must be a list of program ids")
+    return name, email, set(programs)
+
+def insert_client_batch(batch, known_programs):
+    """
+    Insert one batch of (row_number, record) pairs in a single transaction.
+    Existing emails and program ids are resolved with one query each, so the
+    cost per batch is a fixed number of statements. Returns (created, errors).
+    """
+    errors = []
+    valid = []
+    for row_number, record in batch:
+        try:
+            valid.append((row_number,) + validate_bulk_record(record))
+        except ValueError as e:
+            errors.append({"row": row_number, "error": str(e)})
+
+    emails = {email for _, _, email, _ in valid}
+    taken = {r.email for r in Client.query.with_entities(Client.email)
+             .filter(Client.email.in_(emails))} if emails else set()
+    unseen = {pid for *_, pids in valid for pid in pids} - known_programs
+    if unseen:
+        known_programs.update(r.id for r in HealthProgram.query.with_entities(HealthProgram.id)
+                              .filter(HealthProgram.id.in_(unseen)))
+
+    rows = []
+    for row_number, name, email, program_ids in valid:
+        if email in taken:
+            errors.append({"row": row_number, "error": "Client already exists"})
+            continue
+        unknown = program_ids - known_programs
+        if unknown:
+            errors.append({"row": row_number, "error": f"Unknown program ids: {sorted(unknown)}"})
+            continue
+        taken.add(email)
+        rows.append((row_number, name, email, program_ids))
+    if not rows:
+        return 0, errors
+
+    try:
+        inserted = db.session.execute(
+            db.insert(Client).returning(Client.id, sort_by_parameter_order=True),
+            [{"name": name, "email": email} for _, name, email, _ in rows]
+        ).scalars().all()
+        enrollments = [{"client_id": cid, "program_id": pid}
+                       for cid, (*_, program_ids) in zip(inserted, rows)
+                       for pid in program_ids]
+        if enrollments:
+            db.session.execute(client_program.insert(), enrollments)
+        # Bulk inserts skip mapper events, so index the new rows explicitly
+        connection = db.session.connection()
+        get_search_index(connection).index(
+            connection, [(cid, name, email) for cid, (_, name, email, _) in zip(inserted, rows)])
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent writer claimed an email or program; report the whole batch
+        db.session.rollback()
+        return 0, errors + [{"row": row_number, "error": "Batch rejected by the database"}
+                            for row_number, *_ in rows]
+    return len(rows), errors
+
+def client_search_clause(query):
+    """Filter matching every client the search endpoint would find for `query`"""
+    if len(query) < MIN_INDEXED_LENGTH:
+        return Client.name.ilike(escape_like(query) + '%', escape='\\')
+    return Client.id.in_(get_search_index(db.session.connection()).matching_ids(query))
+
+def client_filters(data):
+    """
+    Turn an enrollment request body into filters on Client: either
+    {"client_ids": [...]}, split into chunks of ENROLLMENT_ID_CHUNK ids, or
+    {"query": "..."} using the search index (raises ValueError)
+    """
+    data = data if isinstance(data, dict) else {}
+    client_ids, query = data.get('client_ids'), data.get('query')
+    if (client_ids is None) == (query is None):
+        raise ValueError("Send either 'client_ids' or 'query'")
+    if query is not None:
+        if not isinstance(query, str) or not query.strip():
+            raise ValueError("'query' must be a non-empty string")
+        return [client_search_clause(query.strip())]
+    if not is_id_list(client_ids):
+        raise ValueError("'client_ids' must be a list of client ids")
+    chunk = current_app.config['ENROLLMENT_ID_CHUNK']
+    ids = sorted(set(client_ids))
+    return [Client.id.in_(ids[i:i + chunk]) for i in range(0, len(ids), chunk)]
+
+def enroll_clients(program_id, clause):
+    """INSERT ... SELECT the matching clients not yet in the program; returns rows added"""
+    already = db.exists().where(client_program.c.client_id == Client.id,
+                                client_program.c.program_id == program_id)
+    return db.session.execute(client_program.insert().from_select(
+        ['client_id', 'program_id'],
+        db.select(Client.id, db.literal(program_id)).where(clause, ~already)
+    )).rowcount
+
+def unenroll_clients(program_id, clause):
+    """DELETE the matching clients' enrollments in the program; returns rows removed"""
+    return db.session.execute(client_program.delete().where(
+        client_program.c.program_id == program_id,
+        client_program.c.client_id.in_(db.select(Client.id).where(clause))
+    )).rowcount
+
+# ======================
+# 4. INSTRUMENTATION
+# ======================
+@api.before_app_request
+def start_request_stats():
+    g.request_stats = {"started": time.perf_counter(), "statements": 0, "sql_seconds": 0.0}
+
+def instrument_engine(app, engine):
+    """Count and time every SQL statement against the current request"""
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context.query_started = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context.query_started
+        if has_request_context() and 'request_stats' in g:
+            g.request_stats['statements'] += 1
+            g.request_stats['sql_seconds'] += elapsed
+        if elapsed * 1000 >= app.config['SLOW_QUERY_MS']:
+            app.logger.warning("Slow query (%.1f ms): %s", elapsed * 1000, statement)
+
+def apply_sqlite_pragmas(engine, pragmas):
+    """Run PRAGMA statements on every new connection the engine opens"""
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+@api.after_app_request
+def record_request_stats(response):
+    """
+    Add Server-Timing in debug mode and record the request once the response
+    is closed, so streamed bodies are timed to their last chunk
+    """
+    stats = g.get('request_stats')
+    if stats is None:
+        return response
+    server_timing = current_app.config['SERVER_TIMING']
+    if server_timing or (server_timing is None and current_app.debug):
+        response.headers['Server-Timing'] = (
+            f"app;dur={(time.perf_counter() - stats['started']) * 1000:.1f}, "
+            f"db;dur={stats['sql_seconds'] * 1000:.1f};desc=\"{stats['statements']} queries\"")
+
+    app = current_app._get_current_object()  # The context may be gone when the response closes
+    route = request.url_rule.rule if request.url_rule else '<unmatched>'
+    method, status = request.method, response.status_code
+    size = None if response.is_streamed else response.calculate_content_length()
+
+    def record():
+        seconds = time.perf_counter() - stats['started']
+        app.extensions['metrics'].observe_request(route, method, status, seconds,
+                                                  stats['statements'], stats['sql_seconds'], size)
+        if seconds * 1000 >= app.config['SLOW_REQUEST_MS']:
+            # Log the route pattern, never the URL: search query strings hold patient details
+            app.logger.warning("Slow request (%.1f ms, %d SQL statements): %s %s",
+                               seconds * 1000, stats['statements'], method, route)
+    response.call_on_close(record)
+    return response
+
+@api.route('/metrics', methods=['GET'])
+@rate_limit_exempt
+def prometheus_metrics():
+    """Endpoint exposing request metrics in the Prometheus text format"""
+    return Response(current_app.extensions['metrics'].render(),
+                    content_type='text/plain; version=0.0.4; charset=utf-8')
+
 # ======================
-# 4. API ENDPOINTS
+# 5. API ENDPOINTS
 # ======================
-@app.route('/api/programs', methods=['GET', 'POST'])
+@api.route('/api/programs', methods=['GET', 'POST'])
 @require_api_key
+@cached_response('programs')
 def handle_programs():
     """Endpoint for creating and listing programs"""
     if request.method == 'POST':
@@ -98,24 +626,80 @@ def handle_programs():
         program = HealthProgram(name=data['name'])
         db.session.add(program)
         db.session.commit()
+        get_response_cache().invalidate('programs', 'stats')
         return jsonify({"id": program.id, "name": program.name}), 201
     else:
         # List all programs
         programs = HealthProgram.query.all()
         return jsonify([{"id": p.id, "name": p.name} for p in programs])
 
-@app.route('/api/programs/<int:program_id>', methods=['DELETE'])
+@api.route('/api/programs/<int:program_id>', methods=['DELETE'])
 @require_api_key
 def delete_program(program_id):
     """Endpoint for deleting a program"""
     program = HealthProgram.query.get_or_404(program_id)
+    # Programs have no relationship to their enrollments, so remove them explicitly
+    db.session.execute(client_program.delete().where(client_program.c.program_id == program_id))
     db.session.delete(program)
     db.session.commit()
+    get_response_cache().invalidate('programs', 'clients', 'stats')  # Client listings embed program names
     return jsonify({"message": "Program deleted"}), 200
 
-@app.route('/api/clients', methods=['GET', 'POST'])
-@limiter.limit("10 per minute")
+@api.route('/api/programs/<int:program_id>/enrollments', methods=['POST', 'DELETE'])
+@require_api_key
+def handle_program_enrollments(program_id):
+    """Endpoint for enrolling or unenrolling many clients in a program at once"""
+    db.get_or_404(HealthProgram, program_id)
+    try:
+        filters = client_filters(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    apply = enroll_clients if request.method == 'POST' else unenroll_clients
+    changed = sum(apply(program_id, clause) for clause in filters)
+    db.session.commit()
+    if changed:
+        get_response_cache().invalidate('clients', 'stats')
+    key = "enrolled" if request.method == 'POST' else "removed"
+    return jsonify({"program_id": program_id, key: changed}), 200
+
+@api.route('/api/clients/<int:client_id>/programs', methods=['PUT'])
+@require_api_key
+def replace_client_programs(client_id):
+    """Endpoint for setting exactly which programs a client is enrolled in"""
+    db.get_or_404(Client, client_id)
+    data = request.get_json(silent=True)
+    programs = data.get('programs') if isinstance(data, dict) else None
+    if not is_id_list(programs):
+        return jsonify({"error": "'programs' must be a list of program ids"}), 400
+
+    program_ids = set(programs)
+    known = {r.id for r in HealthProgram.query.with_entities(HealthProgram.id)
+             .filter(HealthProgram.id.in_(program_ids))} if program_ids else set()
+    if program_ids - known:
+        return jsonify({"error": f"Unknown program ids: {sorted(program_ids - known)}"}), 400
+
+    removed = db.session.execute(client_program.delete().where(
+        client_program.c.client_id == client_id,
+        client_program.c.program_id.not_in(program_ids)
+    )).rowcount
+    already = db.exists().where(client_program.c.client_id == client_id,
+                                client_program.c.program_id == HealthProgram.id)
+    added = db.session.execute(client_program.insert().from_select(
+        ['client_id', 'program_id'],
+        db.select(db.literal(client_id), HealthProgram.id)
+        .where(HealthProgram.id.in_(program_ids), ~already)
+    )).rowcount if program_ids else 0
+    db.session.commit()
+    if added or removed:
+        get_response_cache().invalidate('clients', 'stats')
+    return jsonify({"client_id": client_id, "added": added, "removed": removed,
+                    "programs": len(program_ids)}), 200
+
+@api.route('/api/clients', methods=['GET', 'POST'])
+@rate_limit("10 per minute", methods=['POST'])  # Registration only; paging stays cheap
 @require_api_key
+@cached_response('clients')
 def handle_clients():
     """Endpoint for creating and listing clients"""
     if request.method == 'POST':
@@ -138,6 +722,7 @@ def handle_clients():
         
         db.session.add(client)
         db.session.commit()
+        get_response_cache().invalidate('clients', 'stats')
         return jsonify({
             "id": client.id,
             "name": client.name,
@@ -145,41 +730,290 @@ def handle_clients():
             "programs": [{"id": p.id, "name": p.name} for p in client.programs]
         }), 201
     else:
-        # List all clients
-        clients = Client.query.all()
-        return jsonify([{
-            "id": c.id,
-            "name": c.name,
-            "email": c.email,
-            "programs": [{"id": p.id, "name": p.name} for p in c.programs]
-        } for c in clients])
-
-@app.route('/api/clients/<int:client_id>', methods=['DELETE'])
+        # List clients one keyset page at a time
+        return client_page_response(Client.query)
+
+@api.route('/api/clients/<int:client_id>', methods=['DELETE'])
 @require_api_key
 def delete_client(client_id):
     """Endpoint for deleting a client"""
     client = Client.query.get_or_404(client_id)
     db.session.delete(client)
     db.session.commit()
+    get_response_cache().invalidate('clients', 'stats')
     return jsonify({"message": "Client deleted"}), 200
 
-@app.route('/api/clients/search', methods=['GET'])
+@api.route('/api/export/clients', methods=['GET'])
 @require_api_key
+def export_clients():
+    """Endpoint for downloading every client and their enrollments as NDJSON or CSV"""
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"error": f"'format' must be one of {sorted(EXPORT_FORMATS)}"}), 400
+    program_id = request.args.get('program')
+    if program_id is not None:
+        try:
+            program_id = int(program_id)
+        except ValueError:
+            return jsonify({"error": "'program' must be a program id"}), 400
+        db.get_or_404(HealthProgram, program_id)
+    compress = flag_arg('gzip')
+
+    def generate():
+        with db.engine.connect() as connection:
+            yield from export_chunks(connection, fmt, program_id, compress)
+
+    filename = f'clients.{fmt}' + ('.gz' if compress else '')
+    return Response(stream_with_context(generate()),
+                    mimetype='application/gzip' if compress else EXPORT_FORMATS[fmt],
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@api.route('/api/clients/bulk', methods=['POST'])
+@require_api_key
+def bulk_register_clients():
+    """Endpoint for registering many clients from a streamed NDJSON or CSV upload"""
+    if request.mimetype not in ('application/x-ndjson', 'application/ndjson', 'text/csv'):
+        return jsonify({"error": "Send application/x-ndjson or text/csv"}), 415
+
+    max_batch = current_app.config['BULK_MAX_BATCH_SIZE']
+    try:
+        batch_size = int(request.args.get('batch_size', current_app.config['BULK_BATCH_SIZE']))
+    except ValueError:
+        batch_size = 0
+    if not 1 <= batch_size <= max_batch:
+        return jsonify({"error": f"'batch_size' must be between 1 and {max_batch}"}), 400
+
+    created, errors = 0, []
+    known_programs = set()
+    records = iter_bulk_records(request.stream, request.mimetype)
+    try:
+        while batch := list(islice(records, batch_size)):
+            batch_created, batch_errors = insert_client_batch(batch, known_programs)
+            created += batch_created
+            errors += sorted(batch_errors, key=lambda e: e['row'])
+    finally:
+        # Batches commit as they go, so drop cached reads even if a later one fails
+        if created:
+            get_response_cache().invalidate('clients', 'stats')
+
+    return jsonify({"created": created, "failed": len(errors), "errors": errors}), 200
+
+@api.route('/api/clients/search', methods=['GET'])
+@require_api_key
+@cached_response('clients')
 def search_clients():
-    """Endpoint for searching clients by name"""
-    query = request.args.get('query', '')
-    clients = Client.query.filter(Client.name.ilike(f'%{query}%')).all()
-    return jsonify([{
-        "id": c.id,
-        "name": c.name,
-        "email": c.email,
-        "programs": [{"id": p.id, "name": p.name} for p in c.programs]
-    } for c in clients])
+    """Endpoint for searching clients by name or email, best matches first"""
+    query = request.args.get('query', '').strip()
+    if not query:
+        return client_page_response(Client.query)
+
+    # Ranked results have no stable id order to key on, so they page by offset
+    if 'after' in request.args or flag_arg('stream'):
+        return jsonify({"error": "Ranked search pages with ?offset; 'after' and 'stream' "
+                                 "apply to the listing without a query"}), 400
+    max_limit = current_app.config['CLIENT_MAX_PAGE_SIZE']
+    try:
+        limit = int(request.args.get('limit', current_app.config['CLIENT_SEARCH_LIMIT']))
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify({"error": "'limit' and 'offset' must be integers"}), 400
+    if not 1 <= limit <= max_limit:
+        return jsonify({"error": f"'limit' must be between 1 and {max_limit}"}), 400
+    if offset < 0:
+        return jsonify({"error": "'offset' must not be negative"}), 400
+
+    # Fetch one extra id to know whether another page exists
+    if len(query) < MIN_INDEXED_LENGTH:
+        # Too short for the trigram index; fall back to a name prefix match
+        ids = [r.id for r in Client.query.with_entities(Client.id)
+               .filter(Client.name.ilike(escape_like(query) + '%', escape='\\'))
+               .order_by(Client.id).offset(offset).limit(limit + 1)]
+    else:
+        connection = db.session.connection()
+        ids = get_search_index(connection).search(connection, query, limit + 1, offset)
+    next_offset = offset + limit if len(ids) > limit else None
+    ids = ids[:limit]
+
+    rows = {r.id: r for r in Client.query.with_entities(Client.id, Client.name, Client.email)
+            .filter(Client.id.in_(ids))}
+    # Skip ids whose client is gone, e.g. an index not rebuilt after manual edits
+    return jsonify({"clients": serialize_clients([rows[i] for i in ids if i in rows]),
+                    "next": next_offset})
+
+@api.route('/api/stats/programs', methods=['GET'])
+@require_api_key
+@cached_response('stats')
+def program_stats():
+    """Endpoint for enrollment counts per program and programs per client"""
+    bucket = request.args.get('bucket')
+    if bucket not in (None, 'day', 'week', 'month'):
+        return jsonify({"error": "'bucket' must be one of day, week, month"}), 400
+    since = request.args.get('since')
+    if since is not None:
+        try:
+            since = date.fromisoformat(since).isoformat()
+        except ValueError:
+            return jsonify({"error": "'since' must be a YYYY-MM-DD date"}), 400
+
+    connection = db.session.connection()
+    stats = get_enrollment_stats(connection)
+    result = {
+        "programs": [{"id": pid, "name": name, "clients": clients}
+                     for pid, name, clients in stats.program_counts(connection)],
+        "programs_per_client": [{"programs": programs, "clients": clients}
+                                for programs, clients in stats.client_distribution(connection)],
+    }
+    if bucket:
+        totals = stats.new_enrollments(connection, bucket, since)
+        if totals is None:
+            return jsonify({"error": "New enrollment history is only recorded on SQLite"}), 400
+        result["new_enrollments"] = [{"program_id": pid, "period": period, "enrolled": enrolled}
+                                     for (pid, period), enrolled in sorted(totals.items())]
+    return jsonify(result)
+
+@api.cli.command('recompute-enrollment-stats')
+@click.option('--prune-orphans', is_flag=True,
+              help='Delete enrollments whose client or program no longer exists')
+def recompute_enrollment_stats(prune_orphans):
+    """Rebuild enrollment counters from client_program to repair drift"""
+    with db.engine.begin() as connection:
+        orphans = get_enrollment_stats(connection).recompute(connection, prune_orphans)
+    get_response_cache().invalidate('stats')
+    click.echo("Enrollment statistics recomputed")
+    if prune_orphans:
+        click.echo(f"Removed {orphans} orphaned enrollments")
+    elif orphans:
+        click.echo(f"{orphans} orphaned enrollments left out of the counts; "
+                   "rerun with --prune-orphans to delete them")
+
+@api.cli.command('export-clients')
+@click.option('--format', 'fmt', type=click.Choice(sorted(EXPORT_FORMATS)), default='ndjson')
+@click.option('--program', 'program_id', type=int, help='Only clients enrolled in this program')
+@click.option('--gzip', 'compress', is_flag=True, help='Gzip-compress the output')
+@click.option('--output', '-o', type=click.File('wb'), default='-', help='Defaults to stdout')
+def export_clients_command(fmt, program_id, compress, output):
+    """Stream every client and their enrollments to a file"""
+    with db.engine.connect() as connection:
+        for chunk in export_chunks(connection, fmt, program_id, compress):
+            output.write(chunk)
+
+@api.cli.command('rebuild-search-index')
+def rebuild_search_index():
+    """Rebuild the client search index from the client table"""
+    with db.engine.begin() as connection:
+        get_search_index(connection).rebuild(connection)
+    click.echo("Client search index rebuilt")
+
+# ======================
+# 6. APPLICATION FACTORY
+# ======================
+def create_app(profile=None, **overrides):
+    """
+    Build and configure the Flask app. `profile` is 'development' (default) or
+    'production'; keyword overrides are applied last, e.g. for tests.
+    """
+    app = Flask(__name__)
+
+    # Configure CORS (Cross-Origin Resource Sharing)
+    CORS(app, resources={
+        r"/api/*": {
+            "origins": ["http://localhost:8000"],  # Frontend URL
+            "methods": ["GET", "POST", "PUT", "DELETE"],
+            "allow_headers": ["Content-Type", "X-API-KEY"]
+        }
+    })
+
+    # Database configuration
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///health_info.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLITE_PRAGMAS'] = {}
+    app.config['API_KEYS'] = os.getenv('API_KEYS', '').split(',')  # Multiple keys supported
+
+    # Rate limiting; use sqlite:///<path> to share limits between workers
+    app.config['RATELIMIT_STORAGE_URI'] = os.getenv('RATELIMIT_STORAGE_URI', 'memory://')
+
+    # Client listing pagination
+    app.config['CLIENT_PAGE_SIZE'] = 100          # Default page size when ?limit is omitted
+    app.config['CLIENT_MAX_PAGE_SIZE'] = 1000     # Upper bound for buffered responses
+    app.config['CLIENT_MAX_STREAM_SIZE'] = 100000 # Upper bound for ?stream=1 responses
+    app.config['CLIENT_STREAM_BATCH_SIZE'] = 500  # Rows fetched per query while streaming
+    app.config['CLIENT_SEARCH_LIMIT'] = 20        # Default number of ranked search results
+
+    # Bulk client registration
+    app.config['BULK_BATCH_SIZE'] = 1000          # Rows committed per transaction by default
+    app.config['BULK_MAX_BATCH_SIZE'] = 5000      # Keeps IN (...) lists under SQLite's variable limit
+
+    # Bulk enrollment
+    app.config['ENROLLMENT_ID_CHUNK'] = 5000      # Client ids bound per statement
+
+    # Client export
+    app.config['EXPORT_YIELD_PER'] = 1000         # Rows buffered from the database cursor at a time
+    app.config['EXPORT_CHUNK_SIZE'] = 64 * 1024   # Bytes collected before a chunk is written out
+
+    # Response cache for read endpoints; use sqlite:///<path> to share it between workers
+    app.config['RESPONSE_CACHE_URI'] = os.getenv('RESPONSE_CACHE_URI', 'memory://')
+    app.config['RESPONSE_CACHE_MAX_ENTRIES'] = 512
+    app.config['RESPONSE_CACHE_TTL'] = 300         # Seconds
+
+    # Instrumentation; use sqlite:///<path> to report totals across workers at /metrics
+    app.config['METRICS_URI'] = os.getenv('METRICS_URI', 'memory://')
+    app.config['SLOW_REQUEST_MS'] = float(os.getenv('SLOW_REQUEST_MS', 500))
+    app.config['SLOW_QUERY_MS'] = float(os.getenv('SLOW_QUERY_MS', 100))
+    app.config['SERVER_TIMING'] = None             # Server-Timing header; None follows app.debug
+
+    if profile == 'production':
+        app.config.update(PRODUCTION_CONFIG)
+        # Workers share rate limits, cached responses and metrics through the instance folder
+        app.config['RATELIMIT_STORAGE_URI'] = os.getenv('RATELIMIT_STORAGE_URI',
+                                                        'sqlite:///ratelimit.db')
+        app.config['RESPONSE_CACHE_URI'] = os.getenv('RESPONSE_CACHE_URI',
+                                                     'sqlite:///response_cache.db')
+        app.config['METRICS_URI'] = os.getenv('METRICS_URI', 'sqlite:///metrics.db')
+    elif profile not in (None, 'development'):
+        raise ValueError(f"Unknown profile: {profile}")
+    app.config.update(overrides)
+    # Relative store paths live in the instance folder, like the database's
+    for key in ('RATELIMIT_STORAGE_URI', 'RESPONSE_CACHE_URI', 'METRICS_URI'):
+        app.config[key] = resolve_sqlite_uri(app.config[key], app.instance_path)
+
+    db.init_app(app)
+    app.extensions['response_cache'] = make_cache(app.config['RESPONSE_CACHE_URI'],
+                                                  app.config['RESPONSE_CACHE_MAX_ENTRIES'],
+                                                  app.config['RESPONSE_CACHE_TTL'])
+    app.extensions['metrics'] = make_metrics(app.config['METRICS_URI'])
+    app.register_blueprint(api)
+
+    # Limiter decorators bind to one Limiter, so marked views are wrapped per app
+    limiter = Limiter(get_remote_address, app=app, default_limits=DEFAULT_RATE_LIMITS)
+    for endpoint, view in app.view_functions.items():
+        if getattr(view, 'rate_limit_exempt', False):
+            limiter.exempt(view)
+        if getattr(view, 'rate_limit', None):
+            limit, methods = view.rate_limit
+            app.view_functions[endpoint] = limiter.limit(limit, methods=methods)(view)
+    app.extensions['rate_limiter'] = limiter
+
+    with app.app_context():
+        instrument_engine(app, db.engine)
+        if db.engine.dialect.name == 'sqlite' and app.config['SQLITE_PRAGMAS']:
+            apply_sqlite_pragmas(db.engine, app.config['SQLITE_PRAGMAS'])
+    return app
+
+def __getattr__(name):
+    """
+    Build the default app for `flask --app app` and `gunicorn app:app` on first
+    access, so serving create_app('production') does not build it as well
+    """
+    if name == 'app':
+        globals()['app'] = create_app(os.getenv('APP_PROFILE'))
+        return globals()['app']
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # ======================
-# 5. START APPLICATION
+# 7. START APPLICATION
 # ======================
 if __name__ == '__main__':
+    app = create_app(os.getenv('APP_PROFILE'))
     with app.app_context():
         db.create_all()  # Create tables if they don't exist
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
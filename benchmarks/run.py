@@ -0,0 +1,350 @@
+"""
+Health Information System Benchmarks
+Seeds a database with synthetic clients, programs and enrollments, then
+measures throughput and latency percentiles for every API endpoint.
+
+    python benchmarks/run.py --clients 1000000 --programs 50 --enrollments 3
+    python benchmarks/run.py --output new.json --compare baseline.json
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIRST_NAMES = ['Amina', 'Brian', 'Faith', 'Kevin', 'Mercy', 'Otieno', 'Wanjiru', 'Juma',
+               'Achieng', 'Kamau', 'Njeri', 'Mwangi', 'Akinyi', 'Kiprop', 'Zawadi', 'Baraka']
+LAST_NAMES = ['Odhiambo', 'Wafula', 'Mutua', 'Chebet', 'Kariuki', 'Omondi', 'Njoroge',
+              'Wambui', 'Kiptoo', 'Atieno', 'Maina', 'Onyango', 'Jeptoo', 'Nyambura']
+API_KEY = 'benchmark-key'
+# Run settings that must match the baseline for a comparison to mean anything
+COMPARABLE_META = ('clients', 'programs', 'enrollments', 'threads', 'warm_cache')
+MIN_COMPARE_SAMPLES = 20  # Below this p95/p99 is just the slowest request, so it is noise
+
+# ======================
+# 1. STATISTICS
+# ======================
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * pct // 100))  # Ceiling division
+    return sorted_values[int(rank) - 1]
+
+def summarize(latencies, wall_seconds):
+    """Reduce per-request latencies (seconds) to the numbers stored in results"""
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "throughput_rps": round(len(latencies) / wall_seconds, 2) if wall_seconds else 0.0,
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+def meta_mismatches(meta, baseline_meta):
+    """Return the COMPARABLE_META settings that differ from the baseline's"""
+    return [f"{key}: {baseline_meta.get(key)!r} in the baseline, {meta.get(key)!r} now"
+            for key in COMPARABLE_META if meta.get(key) != baseline_meta.get(key)]
+
+def undersampled(results, baseline):
+    """Scenarios with too few requests on either side to compare percentiles"""
+    return sorted(name for name, current in results["results"].items()
+                  if name in baseline["results"]
+                  and min(current["requests"], baseline["results"][name]["requests"])
+                  < MIN_COMPARE_SAMPLES)
+
+def compare(results, baseline, threshold):
+    """
+    Return regressions of `results` against `baseline` as human readable lines.
+    A scenario regresses when its p95 latency grows, or its throughput drops,
+    by more than `threshold` (0.2 == 20%). Undersampled scenarios are skipped.
+    """
+    regressions = []
+    skipped = undersampled(results, baseline)
+    for name, current in sorted(results["results"].items()):
+        before = baseline["results"].get(name)
+        if before is None or name in skipped:
+            continue
+        if before["p95_ms"] and current["p95_ms"] > before["p95_ms"] * (1 + threshold):
+            regressions.append(f"{name}: p95 {before['p95_ms']} ms -> {current['p95_ms']} ms")
+        if current["throughput_rps"] < before["throughput_rps"] * (1 - threshold):
+            regressions.append(f"{name}: throughput {before['throughput_rps']} -> "
+                               f"{current['throughput_rps']} req/s")
+    return regressions
+
+# ======================
+# 2. SYNTHETIC DATA
+# ======================
+def seed(db, clients, programs, enrollments, rng, batch_size=20000):
+    """
+    Fill an empty database with `programs` programs and `clients` clients,
+    each enrolled in `enrollments` distinct random programs. Uses set-based
+    inserts so a million clients take minutes rather than hours.
+    """
+    from app import Client, HealthProgram, client_program
+
+    db.session.execute(db.insert(HealthProgram),
+                       [{"id": i, "name": f"Program {i}"} for i in range(1, programs + 1)])
+    per_client = min(enrollments, programs)
+    for start in range(1, clients + 1, batch_size):
+        ids = range(start, min(start + batch_size, clients + 1))
+        db.session.execute(db.insert(Client), [{
+            "id": i,
+            "name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            "email": f"client{i}@example.org",
+        } for i in ids])
+        db.session.execute(client_program.insert(), [
+            {"client_id": i, "program_id": pid}
+            for i in ids for pid in rng.sample(range(1, programs + 1), per_client)
+        ])
+        db.session.commit()
+
+def schema_fingerprint(db):
+    """
+    Hash the schema the app creates, including the search index and the
+    statistics triggers, so a template seeded by older code is never reused
+    with tables it would have left empty
+    """
+    from sqlalchemy import create_engine
+
+    engine = create_engine('sqlite://')
+    with engine.begin() as connection:
+        db.metadata.create_all(connection)
+        ddl = connection.exec_driver_sql(
+            "SELECT type, name, sql FROM sqlite_master ORDER BY type, name").all()
+    engine.dispose()
+    return hashlib.sha256(repr(ddl).encode()).hexdigest()[:16]
+
+def load_template(template, volumes):
+    """
+    Copy a previously seeded template database to a scratch file so every run
+    starts from identical data. Returns the scratch path and whether the
+    template matched the requested volumes and schema.
+    """
+    working = template + '.run'
+    try:
+        with open(template + '.json') as f:
+            matches = json.load(f) == volumes
+    except (OSError, ValueError):
+        matches = False
+    if matches:
+        shutil.copyfile(template, working)
+    elif os.path.exists(working):
+        os.remove(working)
+    return working, matches
+
+def save_template(db, working, template, volumes):
+    """Keep a pristine copy of freshly seeded data for later runs"""
+    db.session.remove()
+    db.engine.dispose()
+    shutil.copyfile(working, template)
+    with open(template + '.json', 'w') as f:
+        json.dump(volumes, f)
+
+# ======================
+# 3. SCENARIOS
+# ======================
+def build_scenarios(clients, programs, rng):
+    """
+    Return (name, weight, prepare, request) tuples covering every endpoint.
+    `prepare(client, i)` runs untimed and returns state for
+    `request(client, i, state)`, which returns the response to time.
+    `weight` scales the iteration count for scenarios that move lots of data.
+    """
+    headers = {'X-API-KEY': API_KEY}
+    run_id = f"{time.time_ns():x}"
+    sequence = itertools.count()  # Keeps names and emails unique across scenarios and threads
+
+    def get(url):
+        return lambda client, i, state: client.get(url() if callable(url) else url,
+                                                   headers=headers)
+
+    def create_program(client, i, state=None):
+        return client.post('/api/programs', json={'name': f'Bench {run_id} {next(sequence)}'}, headers=headers)
+
+    def create_client(client, i, state=None):
+        return client.post('/api/clients', headers=headers, json={
+            'name': f'Bench Client {i}', 'email': f'bench-{run_id}-{next(sequence)}@example.org',
+            'programs': rng.sample(range(1, programs + 1), min(3, programs))})
+
+    def bulk_body():
+        tag = f'{run_id}-{next(sequence)}'
+        return '\n'.join(json.dumps({
+            'name': f'Bulk Client {n}', 'email': f'bulk-{tag}-{n}@example.org',
+            'programs': [rng.randint(1, programs)]}) for n in range(500))
+
+    def fragment(length):
+        name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+        start = rng.randint(0, len(name) - length)
+        return name[start:start + length]
+
+    return [
+        ('programs.list', 1, None, get('/api/programs')),
+        ('programs.create', 1, None, lambda c, i, s: create_program(c, i)),
+        ('programs.delete', 1, lambda c, i: create_program(c, i).get_json()['id'],
+         lambda c, i, pid: c.delete(f'/api/programs/{pid}', headers=headers)),
+        ('clients.list', 1, None, get('/api/clients?limit=100')),
+        ('clients.list_deep', 1, None,
+         get(lambda: f'/api/clients?after={rng.randint(1, max(clients, 1))}&limit=100')),
+        ('clients.stream', 0.1, None, get('/api/clients?stream=1&limit=10000')),
+        ('clients.create', 1, None, lambda c, i, s: create_client(c, i)),
+        ('clients.delete', 1, lambda c, i: create_client(c, i).get_json()['id'],
+         lambda c, i, cid: c.delete(f'/api/clients/{cid}', headers=headers)),
+        ('clients.search', 1, None, get(lambda: f'/api/clients/search?query={quote(fragment(5))}')),
+        ('clients.search_short', 1, None,
+         get(lambda: f'/api/clients/search?query={quote(fragment(2))}')),
+        ('clients.bulk', 0.1, lambda c, i: bulk_body(),
+         lambda c, i, body: c.post('/api/clients/bulk', data=body, headers=headers,
+                                   content_type='application/x-ndjson')),
+        ('export.program', 0.02, None,
+         get(lambda: f'/api/export/clients?program={rng.randint(1, programs)}')),
+        ('clients.set_programs', 1, None,
+         lambda c, i, s: c.put(f'/api/clients/{rng.randint(1, max(clients, 1))}/programs',
+                               json={'programs': rng.sample(range(1, programs + 1),
+                                                            min(3, programs))},
+                               headers=headers)),
+        ('enrollments.add', 0.1, None,
+         lambda c, i, s: c.post(f'/api/programs/{rng.randint(1, programs)}/enrollments',
+                                json={'query': fragment(5)}, headers=headers)),
+        ('enrollments.remove', 0.1, None,
+         lambda c, i, s: c.delete(f'/api/programs/{rng.randint(1, programs)}/enrollments',
+                                  json={'query': fragment(5)}, headers=headers)),
+        ('stats.programs', 1, None, get('/api/stats/programs')),
+        ('stats.weekly', 1, None, get('/api/stats/programs?bucket=week')),
+        ('metrics', 1, None, get('/metrics')),
+    ]
+
+def run_scenario(app, scenario, iterations, threads, warm_cache):
+    """Run one scenario and return its summary"""
+    response_cache = app.extensions['response_cache']
+    name, weight, prepare, make_request = scenario
+    iterations = max(1, int(iterations * weight))
+
+    def worker(indexes):
+        client = app.test_client()
+        latencies = []
+        for i in indexes:
+            state = prepare(client, i) if prepare else None
+            if not warm_cache:
+                response_cache.clear()
+            started = time.perf_counter()
+            with make_request(client, i, state) as response:
+                response.get_data()  # Drain streamed bodies inside the timing
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                raise RuntimeError(f"{name}: HTTP {response.status_code} {response.get_data()[:200]}")
+        return latencies
+
+    started = time.perf_counter()
+    if threads <= 1:
+        latencies = worker(range(iterations))
+    else:
+        with ThreadPoolExecutor(threads) as pool:
+            chunks = pool.map(worker, [range(t, iterations, threads) for t in range(threads)])
+            latencies = [latency for chunk in chunks for latency in chunk]
+    return summarize(latencies, time.perf_counter() - started)
+
+# ======================
+# 4. COMMAND LINE
+# ======================
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--database', default=os.path.join(ROOT, 'instance', 'benchmark.db'),
+                        help='Seeded template database, reused while volumes and schema match')
+    parser.add_argument('--clients', type=int, default=100000)
+    parser.add_argument('--programs', type=int, default=50)
+    parser.add_argument('--enrollments', type=int, default=3, help='Programs per client')
+    parser.add_argument('--iterations', type=int, default=200, help='Requests per scenario')
+    parser.add_argument('--threads', type=int, default=1, help='Concurrent request threads')
+    parser.add_argument('--only', action='append', help='Run only scenarios with this prefix')
+    parser.add_argument('--warm-cache', action='store_true',
+                        help='Keep the response cache between requests')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed for data and requests')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', help='Baseline results file to check for regressions')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Allowed slowdown before a scenario counts as a regression')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    template = os.path.abspath(args.database)
+    os.makedirs(os.path.dirname(template), exist_ok=True)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        mismatches = meta_mismatches(vars(args), baseline["meta"])
+        if mismatches:
+            print("Refusing to compare against a baseline run with different settings:")
+            for line in mismatches:
+                print(f"  {line}")
+            return 2
+    # The app binds its database when it is built; nothing connects before the copy below
+    os.environ['DATABASE_URL'] = 'sqlite:///' + template + '.run'
+    sys.path.insert(0, ROOT)
+    from app import app, db
+
+    volumes = {"clients": args.clients, "programs": args.programs,
+               "enrollments": args.enrollments, "seed": args.seed,
+               "schema": schema_fingerprint(db)}
+    working, reused = load_template(template, volumes)
+
+    app.config['API_KEYS'] = [API_KEY]
+    app.config['SLOW_QUERY_MS'] = app.config['SLOW_REQUEST_MS'] = float('inf')
+    app.extensions['rate_limiter'].enabled = False
+    rng = random.Random(args.seed)
+
+    with app.app_context():
+        db.create_all()
+        if not reused:
+            started = time.perf_counter()
+            seed(db, args.clients, args.programs, args.enrollments, rng)
+            save_template(db, working, template, volumes)
+            print(f"Seeded {args.clients} clients in {time.perf_counter() - started:.1f}s")
+
+    results = {
+        "meta": {
+            "clients": args.clients, "programs": args.programs,
+            "enrollments": args.enrollments, "iterations": args.iterations,
+            "threads": args.threads, "warm_cache": args.warm_cache,
+            "python": platform.python_version(), "timestamp": int(time.time()),
+        },
+        "results": {},
+    }
+    for scenario in build_scenarios(args.clients, args.programs, rng):
+        if args.only and not any(scenario[0].startswith(prefix) for prefix in args.only):
+            continue
+        summary = run_scenario(app, scenario, args.iterations, args.threads, args.warm_cache)
+        results["results"][scenario[0]] = summary
+        print(f"{scenario[0]:<22} {summary['throughput_rps']:>10.1f} req/s  "
+              f"p50 {summary['p50_ms']:>8.2f} ms  p95 {summary['p95_ms']:>8.2f} ms  "
+              f"p99 {summary['p99_ms']:>8.2f} ms")
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if baseline is not None:
+        for name in undersampled(results, baseline):
+            print(f"SKIPPED {name}: fewer than {MIN_COMPARE_SAMPLES} requests; "
+                  f"raise --iterations to compare it")
+        regressions = compare(results, baseline, args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
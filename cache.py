@@ -0,0 +1,177 @@
+"""
+Response cache
+Stores serialized GET responses per namespace so writes can invalidate
+everything derived from the data they touched. Each namespace has a
+generation that invalidate() bumps; a reader passes the generation it saw
+before rendering to set(), so a response rendered from data that a write
+has since replaced is never stored.
+"""
+
+from collections import OrderedDict
+from sqlitefile import SQLiteFile, sqlite_path
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryCache:
+    """In-process LRU with per-entry TTL; each worker keeps its own copy"""
+
+    def __init__(self, max_entries=512, ttl=300, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()  # key -> (namespace, expires, value)
+        self.generations = {}  # namespace -> number of invalidations
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= self.clock():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[2]
+
+    def generation(self, namespace):
+        with self.lock:
+            return self.generations.get(namespace, 0)
+
+    def set(self, namespace, key, value, generation=None):
+        """Store `value` unless the namespace was invalidated since `generation`"""
+        with self.lock:
+            if generation is not None and generation != self.generations.get(namespace, 0):
+                return False
+            self.entries[key] = (namespace, self.clock() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            return True
+
+    def invalidate(self, *namespaces):
+        with self.lock:
+            for namespace in namespaces:
+                self.generations[namespace] = self.generations.get(namespace, 0) + 1
+            for key in [k for k, e in self.entries.items() if e[0] in namespaces]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class SQLiteCache(SQLiteFile):
+    """Bounded LRU in a local SQLite file shared by every worker on the machine"""
+
+    SCHEMA_VERSION = 2  # Stored in PRAGMA user_version; older cache files are rebuilt
+    ACCESS_RESOLUTION = 1.0  # Seconds; hits within this of the last recorded access skip the write
+
+    def __init__(self, path, max_entries=512, ttl=300, clock=time.time):
+        super().__init__(path)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            if self.connection.execute("PRAGMA user_version").fetchone()[0] != self.SCHEMA_VERSION:
+                # Cached responses are disposable, so an old layout is simply dropped
+                self.connection.execute("DROP TABLE IF EXISTS response_cache")
+                self.connection.execute("DROP TABLE IF EXISTS response_cache_generation")
+                self.connection.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache ("
+                "key TEXT PRIMARY KEY, namespace TEXT NOT NULL, expires REAL NOT NULL, "
+                "accessed REAL NOT NULL, etag TEXT NOT NULL, mimetype TEXT NOT NULL, "
+                "body BLOB NOT NULL)")
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS response_cache_namespace ON response_cache (namespace)")
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS response_cache_accessed ON response_cache (accessed)")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache_generation ("
+                "namespace TEXT PRIMARY KEY, generation INTEGER NOT NULL)")
+
+    def get(self, key):
+        now = self.clock()
+        try:
+            row = self.connection.execute(
+                "SELECT etag, body, mimetype, accessed FROM response_cache "
+                "WHERE key = ? AND expires > ?", (key, now)).fetchone()
+            # Refreshing `accessed` keeps eviction least recently used; doing it at most
+            # once per ACCESS_RESOLUTION keeps most hits read-only on the shared file
+            if row and now - row[3] >= self.ACCESS_RESOLUTION:
+                self.connection.execute(
+                    "UPDATE response_cache SET accessed = ? WHERE key = ?", (now, key))
+        except sqlite3.Error:
+            logger.warning("Response cache read failed; treating as a miss", exc_info=True)
+            return None
+        return (row[0], bytes(row[1]), row[2]) if row else None
+
+    def generation(self, namespace):
+        try:
+            return self.read_generation(namespace)
+        except sqlite3.Error:
+            logger.warning("Response cache read failed", exc_info=True)
+            return -1  # Never current, so nothing rendered now gets stored
+
+    def read_generation(self, namespace):
+        row = self.connection.execute(
+            "SELECT generation FROM response_cache_generation WHERE namespace = ?",
+            (namespace,)).fetchone()
+        return row[0] if row else 0
+
+    def set(self, namespace, key, value, generation=None):
+        """Store `value` unless the namespace was invalidated since `generation`"""
+        etag, body, mimetype = value
+        now = self.clock()
+        try:
+            with self.connection:
+                self.connection.execute("BEGIN IMMEDIATE")
+                if generation is not None and generation != self.read_generation(namespace):
+                    return False
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, namespace, now + self.ttl, now, etag, mimetype, body))
+                self.connection.execute("DELETE FROM response_cache WHERE expires <= ?", (now,))
+                self.connection.execute(
+                    "DELETE FROM response_cache WHERE key NOT IN "
+                    "(SELECT key FROM response_cache ORDER BY accessed DESC LIMIT ?)",
+                    (self.max_entries,))
+                return True
+        except sqlite3.Error:
+            logger.warning("Response cache write failed; response not cached", exc_info=True)
+            return False
+
+    def invalidate(self, *namespaces):
+        # A failure leaves entries to expire after the TTL; the database stays the source of truth
+        try:
+            with self.connection:
+                self.connection.execute("BEGIN IMMEDIATE")
+                self.connection.executemany(
+                    "INSERT INTO response_cache_generation (namespace, generation) VALUES (?, 1) "
+                    "ON CONFLICT (namespace) DO UPDATE SET generation = generation + 1",
+                    [(namespace,) for namespace in namespaces])
+                self.connection.execute(
+                    f"DELETE FROM response_cache WHERE namespace IN "
+                    f"({','.join('?' * len(namespaces))})", namespaces)
+        except sqlite3.Error:
+            logger.error("Response cache invalidation of %s failed; entries stay until they expire",
+                         ', '.join(namespaces), exc_info=True)
+
+    def clear(self):
+        self.connection.execute("DELETE FROM response_cache")
+
+
+def make_cache(uri, max_entries=512, ttl=300):
+    """Build a cache from a URI: memory:// (default) or sqlite:///path/to/cache.db"""
+    if uri == 'memory://':
+        return MemoryCache(max_entries, ttl)
+    if uri.startswith('sqlite:///'):
+        return SQLiteCache(sqlite_path(uri), max_entries, ttl)
+    raise ValueError(f"Unsupported cache backend: {uri}")
@@ -7,6 +7,9 @@ class HealthSystem {
     constructor() {
         // API configuration
         this.apiBase = 'http://localhost:5000/api';
+
+        // Cursor for the next page of the client table (null when exhausted)
+        this.nextClients = null;
         
         // Initialize the application
         this.initEventListeners();
@@ -33,6 +36,11 @@ class HealthSystem {
             await this.handleClientCreate();
         });
 
+        // Fetch the next page of clients into the table
+        document.getElementById('loadMoreClients')?.addEventListener('click', async () => {
+            await this.handleLoadMoreClients();
+        });
+
         // Real-time search with debounce (300ms delay)
         document.getElementById('searchInput')?.addEventListener('input', 
             this.debounce(() => this.handleClientSearch(), 300)
@@ -54,7 +62,8 @@ class HealthSystem {
             
             // Update UI
             this.renderPrograms(programs);
-            this.renderClients(clients);
+            this.renderClients(clients.clients);
+            this.setNextClients(clients.next && `/clients?after=${clients.next}`);
         } catch (error) {
             this.showMessage('error', error.message);
         } finally {
@@ -210,15 +219,45 @@ class HealthSystem {
         }
     }
 
+    /**
+     * Append the next page of clients to the table
+     */
+    async handleLoadMoreClients() {
+        if (!this.nextClients) return;
+        const button = document.getElementById('loadMoreClients');
+        try {
+            this.toggleButtonLoading(button, true);
+            const page = await this.fetchData(this.nextClients);
+            this.renderClients(page.clients, true);
+            this.setNextClients(page.next !== null &&
+                this.nextClients.replace(/(after|offset)=\d+$/, `$1=${page.next}`));
+        } catch (error) {
+            this.showMessage('error', error.message);
+        } finally {
+            this.toggleButtonLoading(button, false);
+        }
+    }
+
+    /**
+     * Remember where the next page of clients starts and show or hide "Load more"
+     * @param {string|null} endpoint - API endpoint for the next page, or null
+     */
+    setNextClients(endpoint) {
+        this.nextClients = endpoint || null;
+        const button = document.getElementById('loadMoreClients');
+        if (button) button.classList.toggle('d-none', !this.nextClients);
+    }
+
     /**
      * Render clients table
      * @param {array} clients - List of client objects
+     * @param {boolean} append - Add rows after the current ones instead of replacing them
      */
-    renderClients(clients) {
+    renderClients(clients, append = false) {
         const tbody = document.getElementById('clientTable');
         if (!tbody) return;
         
-        if (clients.length === 0) {
+        if (clients.length === 0 && !append) {
             tbody.innerHTML = `
                 <tr>
                     <td colspan="4" class="text-center text-muted py-4">
@@ -229,7 +268,7 @@ class HealthSystem {
             return;
         }
         
-        tbody.innerHTML = clients.map(client => `
+        const rows = clients.map(client => `
             <tr>
                 <td>${client.name}</td>
                 <td>${client.email}</td>
@@ -242,6 +281,7 @@ class HealthSystem {
                 </td>
             </tr>
         `).join('');
+        tbody.innerHTML = append ? tbody.innerHTML + rows : rows;
     }
 
     // ======================
@@ -256,7 +296,11 @@ class HealthSystem {
         try {
             this.toggleLoading(true);
             const results = await this.fetchData(`/clients/search?query=${encodeURIComponent(query)}`);
-            this.renderClients(results);
+            this.renderClients(results.clients);
+            // Ranked results page by offset; an empty query returns the id-keyed listing
+            const param = query.trim() ? 'offset' : 'after';
+            this.setNextClients(results.next !== null &&
+                `/clients/search?query=${encodeURIComponent(query)}&${param}=${results.next}`);
         } catch (error) {
             this.showMessage('error', error.message);
         } finally {
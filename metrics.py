@@ -0,0 +1,224 @@
+"""
+Request metrics
+Per-route latency, SQL and response size aggregates rendered in the
+Prometheus text exposition format
+"""
+
+from bisect import bisect_left
+from sqlitefile import SQLiteFile, sqlite_path
+import atexit
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250)
+SIZE_BUCKETS = (256, 1024, 10240, 102400, 1048576, 10485760)
+
+
+class Histogram:
+    """Cumulative-bucket histogram; observations land in the first bucket >= value"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def copy(self):
+        histogram = Histogram(self.buckets)
+        histogram.counts, histogram.sum, histogram.count = list(self.counts), self.sum, self.count
+        return histogram
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+
+def request_values(seconds, statements, sql_seconds, size):
+    """Map one request's measurements to histogram names, skipping unknown sizes"""
+    values = {
+        'http_request_duration_seconds': seconds,
+        'http_request_sql_statements': statements,
+        'http_request_sql_duration_seconds': sql_seconds,
+        'http_response_size_bytes': size,
+    }
+    # Streamed bodies have no size up front
+    return {name: value for name, value in values.items() if value is not None}
+
+
+class Metrics:
+    """Thread-safe registry of per-route request metrics; each worker keeps its own"""
+
+    histograms = {
+        'http_request_duration_seconds': ('Request latency', LATENCY_BUCKETS),
+        'http_request_sql_statements': ('SQL statements issued per request', STATEMENT_BUCKETS),
+        'http_request_sql_duration_seconds': ('Time spent in SQL per request', LATENCY_BUCKETS),
+        'http_response_size_bytes': ('Response body size', SIZE_BUCKETS),
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}  # (route, method, status) -> count
+        self.series = {name: {} for name in self.histograms}  # name -> (route, method) -> Histogram
+
+    def observe_request(self, route, method, status, seconds, statements, sql_seconds, size=None):
+        values = request_values(seconds, statements, sql_seconds, size)
+        with self.lock:
+            key = (route, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            for name, value in values.items():
+                series = self.series[name]
+                if (route, method) not in series:
+                    series[(route, method)] = Histogram(self.histograms[name][1])
+                series[(route, method)].observe(value)
+
+    def snapshot(self):
+        """Return (requests, series) as consistent copies"""
+        with self.lock:
+            return dict(self.requests), {name: {key: h.copy() for key, h in s.items()}
+                                         for name, s in self.series.items()}
+
+    def render(self):
+        """Return all metrics in the Prometheus text format"""
+        requests, series = self.snapshot()
+        lines = ['# HELP http_requests_total Requests handled',
+                 '# TYPE http_requests_total counter']
+        for (route, method, status), count in sorted(requests.items()):
+            lines.append(f'http_requests_total{{route="{route}",method="{method}",'
+                         f'status="{status}"}} {count}')
+        for name, (description, _) in self.histograms.items():
+            lines += [f'# HELP {name} {description}', f'# TYPE {name} histogram']
+            for (route, method), histogram in sorted(series[name].items()):
+                lines += histogram.render(name, f'route="{route}",method="{method}"')
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        with self.lock:
+            self.requests.clear()
+            for series in self.series.values():
+                series.clear()
+
+
+class SQLiteMetrics(SQLiteFile, Metrics):
+    """
+    Request metrics in a local SQLite file that every worker on the machine
+    adds to, so any worker answering a scrape reports the totals of all of
+    them. Requests are counted in memory and added to the file in one write
+    transaction at most every FLUSH_INTERVAL seconds and before each scrape,
+    so other workers' latest requests show up that much later.
+    """
+
+    FLUSH_INTERVAL = 1.0
+
+    def __init__(self, path, clock=time.monotonic):
+        SQLiteFile.__init__(self, path)
+        Metrics.__init__(self)  # Observations not yet added to the file
+        self.clock = clock
+        self.flushed = clock()
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS metric_request ("
+                "route TEXT, method TEXT, status INTEGER, count INTEGER NOT NULL, "
+                "PRIMARY KEY (route, method, status))")
+            # One row per (histogram, route, method, bucket); bucket indexes the bounds, +Inf last
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS metric_bucket ("
+                "name TEXT, route TEXT, method TEXT, bucket INTEGER, count INTEGER NOT NULL, "
+                "PRIMARY KEY (name, route, method, bucket))")
+            # NUMERIC keeps sums of integer histograms (statements, bytes) rendering as integers
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS metric_total ("
+                "name TEXT, route TEXT, method TEXT, sum NUMERIC NOT NULL, count INTEGER NOT NULL, "
+                "PRIMARY KEY (name, route, method))")
+        atexit.register(self.flush)
+
+    def observe_request(self, route, method, status, seconds, statements, sql_seconds, size=None):
+        Metrics.observe_request(self, route, method, status, seconds, statements, sql_seconds, size)
+        if self.clock() - self.flushed >= self.FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """Add the observations counted in memory to the file"""
+        with self.lock:
+            requests, series = self.requests, self.series
+            self.requests, self.series = {}, {name: {} for name in self.histograms}
+            self.flushed = self.clock()
+        if not requests:
+            return
+        try:
+            with self.connection:
+                self.connection.execute("BEGIN IMMEDIATE")
+                self.connection.executemany(
+                    "INSERT INTO metric_request VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT DO UPDATE SET count = count + excluded.count",
+                    [key + (count,) for key, count in requests.items()])
+                self.connection.executemany(
+                    "INSERT INTO metric_bucket VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT DO UPDATE SET count = count + excluded.count",
+                    [(name, route, method, bucket, count)
+                     for name, histograms in series.items()
+                     for (route, method), histogram in histograms.items()
+                     for bucket, count in enumerate(histogram.counts) if count])
+                self.connection.executemany(
+                    "INSERT INTO metric_total VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT DO UPDATE SET sum = sum + excluded.sum, "
+                    "count = count + excluded.count",
+                    [(name, route, method, histogram.sum, histogram.count)
+                     for name, histograms in series.items()
+                     for (route, method), histogram in histograms.items()])
+        except sqlite3.Error:
+            # Metrics are best effort; losing a batch beats failing or blocking requests
+            logger.warning("Dropped %d requests' metrics: shared file not writable",
+                           sum(requests.values()), exc_info=True)
+
+    def snapshot(self):
+        self.flush()
+        with self.connection:
+            self.connection.execute("BEGIN")  # One read transaction for a consistent view
+            requests = {(route, method, status): count for route, method, status, count
+                        in self.connection.execute("SELECT * FROM metric_request")}
+            series = {name: {} for name in self.histograms}
+            for name, route, method, total, count in self.connection.execute(
+                    "SELECT * FROM metric_total"):
+                if name in series:
+                    histogram = Histogram(self.histograms[name][1])
+                    histogram.sum, histogram.count = total, count
+                    series[name][(route, method)] = histogram
+            for name, route, method, bucket, count in self.connection.execute(
+                    "SELECT * FROM metric_bucket"):
+                histogram = series.get(name, {}).get((route, method))
+                if histogram is not None and bucket < len(histogram.counts):
+                    histogram.counts[bucket] = count
+        return requests, series
+
+    def clear(self):
+        Metrics.clear(self)
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            for table in ('metric_request', 'metric_bucket', 'metric_total'):
+                self.connection.execute(f"DELETE FROM {table}")
+
+
+def make_metrics(uri):
+    """Build a metrics registry from a URI: memory:// (default) or sqlite:///path/to/metrics.db"""
+    if uri == 'memory://':
+        return Metrics()
+    if uri.startswith('sqlite:///'):
+        return SQLiteMetrics(sqlite_path(uri))
+    raise ValueError(f"Unsupported metrics backend: {uri}")
@@ -0,0 +1,71 @@
+"""
+Rate limit storage
+A Flask-Limiter storage backend in a local SQLite file, so every worker
+process on the machine counts against the same limits
+"""
+
+from limits.storage import Storage
+from sqlitefile import SQLiteFile, sqlite_path
+import sqlite3
+import time
+
+
+class SQLiteStorage(SQLiteFile, Storage):
+    """
+    Fixed-window counters in SQLite, registered for sqlite:/// storage URIs.
+    Each hit is a single atomic upsert, so concurrent workers never lose counts.
+    """
+
+    STORAGE_SCHEME = ['sqlite']
+    PURGE_EVERY = 1000  # Hits between sweeps of expired windows
+
+    def __init__(self, uri, wrap_exceptions=False, **options):
+        SQLiteFile.__init__(self, sqlite_path(uri))
+        Storage.__init__(self, uri, wrap_exceptions=wrap_exceptions, **options)
+        self.hits = 0
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS rate_limit ("
+            "key TEXT PRIMARY KEY, count INTEGER NOT NULL, expires REAL NOT NULL)")
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def incr(self, key, expiry, amount=1):
+        now = time.time()
+        self.hits += 1
+        if self.hits % self.PURGE_EVERY == 0:
+            self.connection.execute("DELETE FROM rate_limit WHERE expires <= ?", (now,))
+        # Start a new window when the stored one has expired, otherwise add to it
+        return self.connection.execute(
+            "INSERT INTO rate_limit (key, count, expires) VALUES (?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET "
+            "count = CASE WHEN expires <= ? THEN excluded.count ELSE count + excluded.count END, "
+            "expires = CASE WHEN expires <= ? THEN excluded.expires ELSE expires END "
+            "RETURNING count",
+            (key, amount, now + expiry, now, now)).fetchone()[0]
+
+    def get(self, key):
+        row = self.connection.execute(
+            "SELECT count FROM rate_limit WHERE key = ? AND expires > ?",
+            (key, time.time())).fetchone()
+        return row[0] if row else 0
+
+    def get_expiry(self, key):
+        row = self.connection.execute(
+            "SELECT expires FROM rate_limit WHERE key = ? AND expires > ?",
+            (key, time.time())).fetchone()
+        return row[0] if row else time.time()
+
+    def check(self):
+        try:
+            self.connection.execute("SELECT 1")
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        return self.connection.execute("DELETE FROM rate_limit").rowcount
+
+    def clear(self, key):
+        self.connection.execute("DELETE FROM rate_limit WHERE key = ?", (key,))
@@ -0,0 +1,156 @@
+"""
+Client search index
+Substring search over client name and email that scales with the number of
+matches rather than the number of clients
+"""
+
+from sqlalchemy import (Column, Integer, MetaData, String, Table, column, func, or_,
+                        select, table, text)
+
+# Queries shorter than this cannot use a trigram index
+MIN_INDEXED_LENGTH = 3
+
+# Lightweight handles on the tables so this module does not import the app
+client = table('client', column('id'), column('name'), column('email'))
+client_search = table('client_search', column('rowid'))
+
+
+def escape_like(value):
+    """Escape LIKE wildcards so user input is matched literally"""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def trigrams(value):
+    """Split a string into its lowercase 3-character substrings"""
+    value = value.lower()
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+class FTS5SearchIndex:
+    """SQLite FTS5 table with the trigram tokenizer, kept in sync by triggers"""
+
+    statements = [
+        """CREATE VIRTUAL TABLE IF NOT EXISTS client_search USING fts5(
+               name, email, content='client', content_rowid='id', tokenize='trigram')""",
+        """CREATE TRIGGER IF NOT EXISTS client_search_ai AFTER INSERT ON client BEGIN
+               INSERT INTO client_search(rowid, name, email) VALUES (new.id, new.name, new.email);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS client_search_ad AFTER DELETE ON client BEGIN
+               INSERT INTO client_search(client_search, rowid, name, email)
+               VALUES ('delete', old.id, old.name, old.email);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS client_search_au AFTER UPDATE ON client BEGIN
+               INSERT INTO client_search(client_search, rowid, name, email)
+               VALUES ('delete', old.id, old.name, old.email);
+               INSERT INTO client_search(rowid, name, email) VALUES (new.id, new.name, new.email);
+           END""",
+    ]
+
+    def create(self, connection):
+        for statement in self.statements:
+            connection.execute(text(statement))
+
+    def drop(self, connection):
+        for trigger in ('client_search_ai', 'client_search_ad', 'client_search_au'):
+            connection.execute(text(f'DROP TRIGGER IF EXISTS {trigger}'))
+        connection.execute(text('DROP TABLE IF EXISTS client_search'))
+
+    def rebuild(self, connection):
+        self.create(connection)
+        connection.execute(text("INSERT INTO client_search(client_search) VALUES ('rebuild')"))
+
+    def index(self, connection, rows):
+        """Triggers already index new rows"""
+
+    def unindex(self, connection, client_ids):
+        """Triggers already remove deleted rows"""
+
+    def matching_ids(self, query):
+        """Select the id of every client whose name or email contains `query`"""
+        return (select(client_search.c.rowid)
+                .where(text('client_search MATCH :phrase').bindparams(phrase=self.phrase(query))))
+
+    def phrase(self, query):
+        """Quote a query as an FTS5 phrase so its characters match literally"""
+        return '"' + query.replace('"', '""') + '"'
+
+    def search(self, connection, query, limit, offset=0):
+        """Return up to `limit` client ids, name prefix matches first, then by bm25 rank"""
+        phrase = self.phrase(query)
+        rows = connection.execute(text(
+            "SELECT rowid FROM client_search WHERE client_search MATCH :phrase "
+            "ORDER BY name LIKE :prefix ESCAPE '\\' DESC, rank, rowid LIMIT :limit OFFSET :offset"
+        ), {"phrase": phrase, "prefix": escape_like(query) + '%', "limit": limit, "offset": offset})
+        return [row[0] for row in rows]
+
+
+class TrigramSearchIndex:
+    """Portable trigram posting table maintained by the application"""
+
+    metadata = MetaData()
+    table = Table('client_trigram', metadata,
+        Column('trigram', String(3), primary_key=True),
+        Column('client_id', Integer, primary_key=True, index=True)
+    )
+
+    def create(self, connection):
+        self.metadata.create_all(connection)
+
+    def drop(self, connection):
+        self.metadata.drop_all(connection)
+
+    def rebuild(self, connection, batch_size=1000):
+        self.create(connection)
+        connection.execute(self.table.delete())
+        after = 0
+        while True:
+            rows = connection.execute(
+                select(client.c.id, client.c.name, client.c.email)
+                .where(client.c.id > after).order_by(client.c.id).limit(batch_size)).all()
+            if not rows:
+                return
+            self.index(connection, rows)
+            after = rows[-1][0]
+
+    def index(self, connection, rows):
+        """Add postings for (id, name, email) rows"""
+        postings = [{"trigram": t, "client_id": client_id}
+                    for client_id, name, email in rows
+                    for t in trigrams(name) | trigrams(email)]
+        if postings:
+            connection.execute(self.table.insert(), postings)
+
+    def unindex(self, connection, client_ids):
+        if client_ids:
+            connection.execute(self.table.delete().where(self.table.c.client_id.in_(client_ids)))
+
+    def matching_ids(self, query):
+        """Select the id of every client whose name or email contains `query`"""
+        grams = trigrams(query)
+        pattern = escape_like(query.lower())
+        # Clients holding every trigram are candidates; LIKE drops non-contiguous hits
+        candidates = (select(self.table.c.client_id)
+                      .where(self.table.c.trigram.in_(grams))
+                      .group_by(self.table.c.client_id)
+                      .having(func.count() == len(grams)))
+        return (select(client.c.id)
+                .where(client.c.id.in_(candidates))
+                .where(or_(func.lower(client.c.name).like(f'%{pattern}%', escape='\\'),
+                           func.lower(client.c.email).like(f'%{pattern}%', escape='\\'))))
+
+    def search(self, connection, query, limit, offset=0):
+        """Return up to `limit` client ids, name prefix matches first, then shortest names"""
+        pattern = escape_like(query.lower())
+        rows = connection.execute(
+            self.matching_ids(query)
+            .order_by(func.lower(client.c.name).like(f'{pattern}%', escape='\\').desc(),
+                      func.length(client.c.name), client.c.id)
+            .limit(limit).offset(offset))
+        return [row[0] for row in rows]
+
+
+def get_search_index(connection):
+    """Pick the index implementation for the connection's database backend"""
+    if connection.dialect.name == 'sqlite':
+        return FTS5SearchIndex()
+    return TrigramSearchIndex()
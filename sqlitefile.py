@@ -0,0 +1,43 @@
+"""
+Shared SQLite files
+Base for the stores that worker processes on one machine share through a
+local SQLite file (rate limits, cached responses and metrics)
+"""
+
+import os
+import sqlite3
+import threading
+
+
+def sqlite_path(uri):
+    """Path from a sqlite:/// URI, read like SQLAlchemy: sqlite:///relative.db, sqlite:////abs.db"""
+    if not uri.startswith('sqlite:///'):
+        raise ValueError(f"Not a sqlite:/// URI: {uri}")
+    return uri[len('sqlite:///'):]
+
+
+def resolve_sqlite_uri(uri, base):
+    """Anchor a relative sqlite:/// URI at `base`, as Flask-SQLAlchemy does for the database"""
+    if not uri.startswith('sqlite:///') or os.path.isabs(sqlite_path(uri)):
+        return uri
+    os.makedirs(base, exist_ok=True)
+    return 'sqlite:///' + os.path.join(base, sqlite_path(uri))
+
+
+class SQLiteFile:
+    """Gives each thread its own autocommit WAL connection to `path`"""
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+
+    @property
+    def connection(self):
+        """One autocommit connection per thread, reopened in forked workers"""
+        if getattr(self.local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return self.local.connection
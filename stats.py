@@ -0,0 +1,221 @@
+"""
+Enrollment statistics
+Per-program enrollment counts, the programs-per-client distribution and
+daily new-enrollment counts, kept in summary tables so reading them costs
+O(programs) whatever the number of enrollments
+"""
+
+from datetime import date
+from sqlalchemy import (Column, Integer, MetaData, String, Table, column, func, select,
+                        table, text)
+
+# Lightweight handles on the app tables so this module does not import the app
+client = table('client', column('id'))
+health_program = table('health_program', column('id'), column('name'))
+client_program = table('client_program', column('client_id'), column('program_id'))
+
+
+def orphaned_enrollments():
+    """Clause matching enrollments whose client or program no longer exists"""
+    return (client_program.c.client_id.not_in(select(client.c.id))
+            | client_program.c.program_id.not_in(select(health_program.c.id)))
+
+
+def check_orphans(connection, prune=False):
+    """Count orphaned enrollments, deleting them only when `prune` is set"""
+    if prune:
+        return connection.execute(client_program.delete().where(orphaned_enrollments())).rowcount
+    return connection.execute(
+        select(func.count()).select_from(client_program).where(orphaned_enrollments())).scalar()
+
+
+# Every program with its enrolled clients; orphaned enrollments join to a NULL client
+enrolled_clients = (health_program
+                    .outerjoin(client_program, client_program.c.program_id == health_program.c.id)
+                    .outerjoin(client, client.c.id == client_program.c.client_id))
+
+
+def bucket_period(day, bucket):
+    """Map an ISO date string to its day, ISO week (2026-W42) or month (2026-10)"""
+    if bucket == 'day':
+        return day
+    if bucket == 'month':
+        return day[:7]
+    year, week, _ = date.fromisoformat(day).isocalendar()
+    return f'{year}-W{week:02d}'
+
+
+class SQLiteEnrollmentStats:
+    """Summary tables maintained by SQLite triggers on every enrollment change"""
+
+    metadata = MetaData()
+    program_stats = Table('program_enrollment_stats', metadata,
+        Column('program_id', Integer, primary_key=True),
+        Column('clients', Integer, nullable=False, default=0)
+    )
+    distribution = Table('client_program_distribution', metadata,
+        Column('programs', Integer, primary_key=True),  # Programs a client is enrolled in
+        Column('clients', Integer, nullable=False, default=0)
+    )
+    daily = Table('enrollment_daily', metadata,
+        Column('program_id', Integer, primary_key=True),
+        Column('day', String(10), primary_key=True),  # UTC date the enrollments were made
+        Column('enrolled', Integer, nullable=False, default=0)
+    )
+
+    # Moves a client from the bucket for `before` programs to the one for `after`
+    move_bucket = """
+        UPDATE client_program_distribution SET clients = clients - 1 WHERE programs = {before};
+        INSERT INTO client_program_distribution (programs, clients) VALUES ({after}, 1)
+            ON CONFLICT (programs) DO UPDATE SET clients = clients + 1;"""
+    enrolled = "(SELECT COUNT(*) FROM client_program WHERE client_id = {id})"
+
+    triggers = {
+        'stats_program_ai': """AFTER INSERT ON health_program BEGIN
+            INSERT OR IGNORE INTO program_enrollment_stats (program_id, clients) VALUES (new.id, 0);
+        END""",
+        'stats_program_ad': """AFTER DELETE ON health_program BEGIN
+            DELETE FROM program_enrollment_stats WHERE program_id = old.id;
+            DELETE FROM enrollment_daily WHERE program_id = old.id;
+        END""",
+        'stats_enrollment_ai': """AFTER INSERT ON client_program BEGIN
+            INSERT INTO program_enrollment_stats (program_id, clients) VALUES (new.program_id, 1)
+                ON CONFLICT (program_id) DO UPDATE SET clients = clients + 1;
+            INSERT INTO enrollment_daily (program_id, day, enrolled)
+                VALUES (new.program_id, date('now'), 1)
+                ON CONFLICT (program_id, day) DO UPDATE SET enrolled = enrolled + 1;
+        END""",
+        'stats_enrollment_ad': """AFTER DELETE ON client_program BEGIN
+            UPDATE program_enrollment_stats SET clients = clients - 1
+                WHERE program_id = old.program_id;
+        END""",
+        # Enrollment rows for clients that no longer exist do not move buckets
+        'stats_distribution_ai': f"""AFTER INSERT ON client_program
+            WHEN EXISTS (SELECT 1 FROM client WHERE id = new.client_id) BEGIN
+            {move_bucket.format(before=enrolled.format(id='new.client_id') + ' - 1',
+                                after=enrolled.format(id='new.client_id'))}
+        END""",
+        'stats_distribution_ad': f"""AFTER DELETE ON client_program
+            WHEN EXISTS (SELECT 1 FROM client WHERE id = old.client_id) BEGIN
+            {move_bucket.format(before=enrolled.format(id='old.client_id') + ' + 1',
+                                after=enrolled.format(id='old.client_id'))}
+        END""",
+        'stats_client_ai': """AFTER INSERT ON client BEGIN
+            INSERT INTO client_program_distribution (programs, clients) VALUES (0, 1)
+                ON CONFLICT (programs) DO UPDATE SET clients = clients + 1;
+        END""",
+        'stats_client_ad': f"""AFTER DELETE ON client BEGIN
+            UPDATE client_program_distribution SET clients = clients - 1
+                WHERE programs = {enrolled.format(id='old.id')};
+        END""",
+    }
+
+    def create(self, connection):
+        self.metadata.create_all(connection)
+        for name, body in self.triggers.items():
+            connection.execute(text(f'CREATE TRIGGER IF NOT EXISTS {name} {body}'))
+
+    def drop(self, connection):
+        for name in self.triggers:
+            connection.execute(text(f'DROP TRIGGER IF EXISTS {name}'))
+        self.metadata.drop_all(connection)
+
+    def recompute(self, connection, prune_orphans=False):
+        """
+        Rebuild the counts from client_program, leaving out enrollments whose
+        client or program no longer exists (deleted only with `prune_orphans`).
+        Daily history cannot be rebuilt because enrollments carry no
+        timestamp, so it is left as recorded. Returns the orphan count.
+        """
+        self.create(connection)
+        orphans = check_orphans(connection, prune_orphans)
+
+        connection.execute(self.program_stats.delete())
+        connection.execute(self.program_stats.insert().from_select(
+            ['program_id', 'clients'],
+            select(health_program.c.id, func.count(client.c.id))
+            .select_from(enrolled_clients)
+            .group_by(health_program.c.id)))
+
+        per_client = (select(func.count(client_program.c.program_id).label('programs'))
+                      .select_from(client.outerjoin(
+                          client_program, client_program.c.client_id == client.c.id))
+                      .group_by(client.c.id)
+                      .subquery())
+        connection.execute(self.distribution.delete())
+        connection.execute(self.distribution.insert().from_select(
+            ['programs', 'clients'],
+            select(per_client.c.programs, func.count()).group_by(per_client.c.programs)))
+        return orphans
+
+    def program_counts(self, connection):
+        """(id, name, clients) for every program"""
+        return connection.execute(
+            select(health_program.c.id, health_program.c.name,
+                   func.coalesce(self.program_stats.c.clients, 0))
+            .select_from(health_program.outerjoin(
+                self.program_stats, self.program_stats.c.program_id == health_program.c.id))
+            .order_by(health_program.c.id)).all()
+
+    def client_distribution(self, connection):
+        """(programs, clients) pairs for every non-empty bucket"""
+        return connection.execute(
+            select(self.distribution.c.programs, self.distribution.c.clients)
+            .where(self.distribution.c.clients > 0)
+            .order_by(self.distribution.c.programs)).all()
+
+    def new_enrollments(self, connection, bucket, since=None):
+        """{(program_id, period): enrolled} for enrollments made on or after `since`"""
+        stmt = select(self.daily.c.program_id, self.daily.c.day, self.daily.c.enrolled)
+        if since is not None:
+            stmt = stmt.where(self.daily.c.day >= since)
+        totals = {}
+        for program_id, day, enrolled in connection.execute(stmt):
+            key = (program_id, bucket_period(day, bucket))
+            totals[key] = totals.get(key, 0) + enrolled
+        return totals
+
+
+class QueryEnrollmentStats:
+    """
+    Portable fallback that aggregates client_program on every read. Correct
+    on any database but O(enrollments), and without new-enrollment history.
+    """
+
+    def create(self, connection):
+        pass
+
+    def drop(self, connection):
+        pass
+
+    def recompute(self, connection, prune_orphans=False):
+        """Nothing is stored; only report (or prune) orphaned enrollments"""
+        return check_orphans(connection, prune_orphans)
+
+    def program_counts(self, connection):
+        return connection.execute(
+            select(health_program.c.id, health_program.c.name, func.count(client.c.id))
+            .select_from(enrolled_clients)
+            .group_by(health_program.c.id, health_program.c.name)
+            .order_by(health_program.c.id)).all()
+
+    def client_distribution(self, connection):
+        per_client = (select(func.count(client_program.c.program_id).label('programs'))
+                      .select_from(client.outerjoin(
+                          client_program, client_program.c.client_id == client.c.id))
+                      .group_by(client.c.id)
+                      .subquery())
+        return connection.execute(
+            select(per_client.c.programs, func.count())
+            .group_by(per_client.c.programs)
+            .order_by(per_client.c.programs)).all()
+
+    def new_enrollments(self, connection, bucket, since=None):
+        return None
+
+
+def get_enrollment_stats(connection):
+    """Pick the statistics implementation for the connection's database backend"""
+    if connection.dialect.name == 'sqlite':
+        return SQLiteEnrollmentStats()
+    return QueryEnrollmentStats()
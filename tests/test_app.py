@@ -1,14 +1,46 @@
+import csv
+import gzip
+import io
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
 import unittest
-from app import app, db
+from unittest import mock
+from datetime import datetime, timedelta, timezone
+from flask import Flask
+
+# Bind the app to a throwaway database before it is imported
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from app import (app, create_app, db, client_program,
+                 Client as AppClient, HealthProgram as AppProgram)
+from cache import MemoryCache, SQLiteCache
+from metrics import Metrics, SQLiteMetrics
+from search import TrigramSearchIndex
+from ratelimit import SQLiteStorage
+from limits.storage import MemoryStorage
+from benchmarks.run import (build_scenarios, compare, load_template, meta_mismatches, percentile,
+                            run_scenario, schema_fingerprint, seed, undersampled)
 from models import Client, HealthProgram
 
+limiter = app.extensions['rate_limiter']
+metrics = app.extensions['metrics']
+
 class HealthInfoSystemTestCase(unittest.TestCase):
     def setUp(self):
         app.config['TESTING'] = True
         app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        app.config['API_KEYS'] = ['test-key']
+        limiter.enabled = False
         self.app = app.test_client()
+        self.headers = {'X-API-KEY': 'test-key'}
         with app.app_context():
             db.create_all()
+        app.extensions['response_cache'].clear()
 
     def tearDown(self):
         with app.app_context():
@@ -16,12 +48,698 @@ class HealthInfoSystemTestCase(unittest.TestCase):
             db.drop_all()
 
     def test_create_program(self):
-        response = self.app.post('/programs', json={'name': 'HIV'})
+        response = self.app.post('/api/programs', json={'name': 'HIV'}, headers=self.headers)
         self.assertEqual(response.status_code, 201)
 
     def test_register_client(self):
-        response = self.app.post('/clients', json={'name': 'John Doe', 'email': 'john@example.com'})
+        response = self.app.post('/api/clients', json={'name': 'John Doe', 'email': 'john@example.com'},
+                                 headers=self.headers)
         self.assertEqual(response.status_code, 201)
 
+
+class APITestCase(unittest.TestCase):
+    """Base case for the /api endpoints with a valid API key and no rate limits"""
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['API_KEYS'] = ['test-key']
+        limiter.enabled = False
+        self.app = app.test_client()
+        self.headers = {'X-API-KEY': 'test-key'}
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.create_all()
+        app.extensions['response_cache'].clear()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def seed_clients(self, count, programs=()):
+        """Insert `count` clients enrolled in every program named in `programs`"""
+        program_rows = [AppProgram(name=name) for name in programs]
+        db.session.add_all(program_rows)
+        for i in range(count):
+            db.session.add(AppClient(name=f'Client {i}', email=f'client{i}@example.com',
+                                     programs=list(program_rows)))
+        db.session.commit()
+
+
+class ClientListingTestCase(APITestCase):
+    def test_pages_follow_next_cursor(self):
+        self.seed_clients(5, programs=['HIV', 'TB'])
+        first = self.app.get('/api/clients?limit=2', headers=self.headers).get_json()
+        self.assertEqual([c['name'] for c in first['clients']], ['Client 0', 'Client 1'])
+        self.assertEqual([p['name'] for p in first['clients'][0]['programs']], ['HIV', 'TB'])
+
+        seen = [c['id'] for c in first['clients']]
+        cursor = first['next']
+        while cursor is not None:
+            page = self.app.get(f'/api/clients?after={cursor}&limit=2', headers=self.headers).get_json()
+            seen += [c['id'] for c in page['clients']]
+            cursor = page['next']
+        self.assertEqual(len(seen), 5)
+        self.assertEqual(seen, sorted(seen))
+
+    def test_stream_matches_buffered_response(self):
+        self.seed_clients(7, programs=['Malaria'])
+        app.config['CLIENT_STREAM_BATCH_SIZE'] = 3
+        try:
+            buffered = self.app.get('/api/clients?limit=5', headers=self.headers).get_json()
+            streamed = self.app.get('/api/clients?limit=5&stream=1', headers=self.headers).get_json()
+        finally:
+            app.config['CLIENT_STREAM_BATCH_SIZE'] = 500
+        self.assertEqual(streamed, buffered)
+        self.assertEqual(buffered['next'], buffered['clients'][-1]['id'])
+
+    def test_registration_limit_does_not_cap_paging(self):
+        limiter.enabled = True
+        limiter.reset()
+        try:
+            for _ in range(12):
+                self.assertEqual(self.app.get('/api/clients', headers=self.headers).status_code, 200)
+            statuses = [self.app.post('/api/clients', json={'name': f'C{i}', 'email': f'c{i}@example.com'},
+                                      headers=self.headers).status_code for i in range(11)]
+        finally:
+            limiter.reset()
+            limiter.enabled = False
+        self.assertEqual(statuses, [201] * 10 + [429])
+
+    def test_invalid_page_args(self):
+        response = self.app.get('/api/clients?limit=0', headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+        response = self.app.get('/api/clients?after=abc', headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+
+class ClientSearchTestCase(APITestCase):
+    def setUp(self):
+        super().setUp()
+        for name, email in [('Mary Johnson', 'mary@example.com'), ('John Doe', 'jd@example.com'),
+                            ('Ann Lee', 'ann.johnston@example.com'), ('Peter Pan', 'pp@example.com')]:
+            db.session.add(AppClient(name=name, email=email))
+        db.session.commit()
+
+    def search(self, query, **params):
+        params['query'] = query
+        response = self.app.get('/api/clients/search', query_string=params, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        return [c['name'] for c in response.get_json()['clients']]
+
+    def test_substring_match_ranks_prefix_first(self):
+        self.assertEqual(self.search('john')[0], 'John Doe')
+        self.assertCountEqual(self.search('john'), ['John Doe', 'Mary Johnson', 'Ann Lee'])
+        self.assertEqual(self.search('john', limit=1), ['John Doe'])
+
+    def test_ranked_results_page_by_offset(self):
+        response = self.app.get('/api/clients/search?query=john&limit=2', headers=self.headers).get_json()
+        self.assertEqual(response['next'], 2)
+        rest = self.app.get('/api/clients/search?query=john&limit=2&offset=2', headers=self.headers).get_json()
+        self.assertIsNone(rest['next'])
+        names = [c['name'] for c in response['clients'] + rest['clients']]
+        self.assertCountEqual(names, ['John Doe', 'Mary Johnson', 'Ann Lee'])
+        for params in ('after=1', 'stream=1', 'offset=-1'):
+            response = self.app.get(f'/api/clients/search?query=john&{params}', headers=self.headers)
+            self.assertEqual(response.status_code, 400)
+
+    def test_stale_index_entries_are_skipped(self):
+        john = AppClient.query.filter_by(name='John Doe').one().id
+        index = mock.Mock(search=mock.Mock(return_value=[999, john]))
+        with mock.patch('app.get_search_index', return_value=index):
+            self.assertEqual(self.search('john'), ['John Doe'])
+
+    def test_short_query_matches_name_prefix(self):
+        self.assertEqual(self.search('pe'), ['Peter Pan'])
+
+    def test_index_follows_deletes(self):
+        client = AppClient.query.filter_by(name='John Doe').one()
+        self.app.delete(f'/api/clients/{client.id}', headers=self.headers)
+        self.assertNotIn('John Doe', self.search('john'))
+
+    def test_rebuild_command(self):
+        result = app.test_cli_runner().invoke(args=['rebuild-search-index'])
+        self.assertIn('rebuilt', result.output)
+        self.assertEqual(self.search('peter'), ['Peter Pan'])
+
+    def test_trigram_backend(self):
+        index = TrigramSearchIndex()
+        connection = db.session.connection()
+        index.rebuild(connection)
+        ids = index.search(connection, 'john', 10)
+        names = [db.session.get(AppClient, i).name for i in ids]
+        self.assertEqual(names[0], 'John Doe')
+        self.assertCountEqual(names, ['John Doe', 'Mary Johnson', 'Ann Lee'])
+        index.drop(connection)
+
+
+class BulkRegistrationTestCase(APITestCase):
+    def post_bulk(self, body, content_type, **params):
+        return self.app.post('/api/clients/bulk', data=body, content_type=content_type,
+                             query_string=params, headers=self.headers)
+
+    def test_ndjson_reports_bad_rows_and_keeps_going(self):
+        self.seed_clients(1, programs=['HIV'])
+        hiv = AppProgram.query.filter_by(name='HIV').one()
+        body = '\n'.join([
+            json.dumps({'name': 'Ann', 'email': 'ann@example.com', 'programs': [hiv.id]}),
+            'not json',
+            json.dumps({'name': 'Dup', 'email': 'client0@example.com'}),
+            '',
+            json.dumps({'name': 'Bob', 'email': 'bob@example.com', 'programs': [999]}),
+            json.dumps({'name': 'Cy', 'email': 'cy@example.com'}),
+            json.dumps({'name': 'Cy again', 'email': 'cy@example.com'}),
+            json.dumps({'email': 'nameless@example.com'}),
+        ])
+        result = self.post_bulk(body, 'application/x-ndjson', batch_size=3).get_json()
+        self.assertEqual(result['created'], 2)
+        self.assertEqual([e['row'] for e in result['errors']], [2, 3, 5, 7, 8])
+
+        ann = AppClient.query.filter_by(email='ann@example.com').one()
+        self.assertEqual([p.name for p in ann.programs], ['HIV'])
+        names = [c['name'] for c in self.app.get('/api/clients/search?query=ann@',
+                                                 headers=self.headers).get_json()['clients']]
+        self.assertEqual(names, ['Ann'])
+
+    def test_csv_upload(self):
+        self.seed_clients(0, programs=['TB', 'Malaria'])
+        ids = [p.id for p in AppProgram.query.order_by(AppProgram.id)]
+        body = f'name,email,programs\nAnn,ann@example.com,{ids[0]};{ids[1]}\nBob,bob@example.com,\n'
+        result = self.post_bulk(body, 'text/csv').get_json()
+        self.assertEqual((result['created'], result['failed']), (2, 0))
+        ann = AppClient.query.filter_by(email='ann@example.com').one()
+        self.assertEqual(sorted(p.name for p in ann.programs), ['Malaria', 'TB'])
+
+    def test_undecodable_rows_are_reported(self):
+        self.app.get('/api/clients', headers=self.headers)  # Cache the listing
+        lines = [json.dumps({'name': f'C{i}', 'email': f'c{i}@example.com'}).encode() for i in range(5)]
+        lines[2] = b'{"name": "Bad \xff", "email": "bad@example.com"}'
+        result = self.post_bulk(b'\n'.join(lines), 'application/x-ndjson', batch_size=2).get_json()
+        self.assertEqual(result['created'], 4)
+        self.assertEqual(result['errors'], [{'row': 3, 'error': 'Row is not valid UTF-8'}])
+        listing = self.app.get('/api/clients', headers=self.headers).get_json()
+        self.assertEqual(len(listing['clients']), 4)
+
+    def test_csv_bad_rows_and_byte_order_mark(self):
+        body = ('\ufeffname,email,programs\n'
+                'Ann,ann@example.com,\n'
+                f'Huge,{"x" * (csv.field_size_limit() + 1)},\n'
+                'Bob,bob@example.com,\n').encode('utf-8') + b'Caf\xe9,cafe@example.com,\n'
+        result = self.post_bulk(body, 'text/csv').get_json()
+        self.assertEqual(result['created'], 2)
+        self.assertEqual([e['row'] for e in result['errors']], [3, 5])  # File lines, header is 1
+        self.assertIn('Malformed CSV row', result['errors'][0]['error'])
+
+    def test_csv_errors_report_file_lines(self):
+        body = 'name,email,programs\n\nC,c@example.com,\n\n,bad@example.com,\n"Multi\nline",,\n'
+        result = self.post_bulk(body, 'text/csv').get_json()
+        self.assertEqual(result['created'], 1)
+        self.assertEqual([e['row'] for e in result['errors']], [5, 6])
+
+    def test_program_ids_must_be_integers(self):
+        self.seed_clients(0, programs=['HIV'])
+        hiv = AppProgram.query.one().id
+        body = '\n'.join(json.dumps({'name': f'C{i}', 'email': f'c{i}@example.com', 'programs': p})
+                         for i, p in enumerate([[True], [hiv + 0.9], [str(hiv)], [hiv]]))
+        result = self.post_bulk(body, 'application/x-ndjson').get_json()
+        self.assertEqual(result['created'], 1)
+        self.assertEqual([e['row'] for e in result['errors']], [1, 2, 3])
+
+        body = f'name,email,programs\nA,a@example.com,{hiv}.0\nB,b@example.com,x\nC,c@example.com, {hiv} \n'
+        result = self.post_bulk(body, 'text/csv').get_json()
+        self.assertEqual((result['created'], result['failed']), (1, 2))
+        self.assertEqual(AppProgram.query.one().id, hiv)
+        self.assertEqual(db.session.query(client_program).count(), 2)
+
+    def test_rejects_unknown_content_type(self):
+        self.assertEqual(self.post_bulk('{}', 'application/json').status_code, 415)
+
+
+class ExportTestCase(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.seed_clients(3, programs=['HIV', 'TB'])
+        db.session.add(AppClient(name='Solo', email='solo@example.com'))
+        db.session.commit()
+        app.config['EXPORT_CHUNK_SIZE'] = 16  # Exercise chunking on a tiny table
+
+    def tearDown(self):
+        app.config['EXPORT_CHUNK_SIZE'] = 64 * 1024
+        super().tearDown()
+
+    def test_ndjson_export(self):
+        response = self.app.get('/api/export/clients', headers=self.headers)
+        records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual(len(records), 4)
+        self.assertEqual([p['name'] for p in records[0]['programs']], ['HIV', 'TB'])
+        self.assertEqual(records[-1]['programs'], [])
+
+    def test_gzipped_csv_filtered_by_program(self):
+        hiv = AppProgram.query.filter_by(name='HIV').one()
+        response = self.app.get(f'/api/export/clients?format=csv&gzip=1&program={hiv.id}',
+                                headers=self.headers)
+        self.assertEqual(response.mimetype, 'application/gzip')
+        rows = list(csv.DictReader(io.StringIO(gzip.decompress(response.data).decode())))
+        self.assertEqual([r['name'] for r in rows], ['Client 0', 'Client 1', 'Client 2'])
+        self.assertEqual(rows[0]['program_names'], 'HIV;TB')
+
+    def test_unknown_program(self):
+        response = self.app.get('/api/export/clients?program=999', headers=self.headers)
+        self.assertEqual(response.status_code, 404)
+
+    def test_cli_export(self):
+        result = app.test_cli_runner().invoke(args=['export-clients', '--format', 'csv'])
+        self.assertEqual(result.output.splitlines()[0], 'id,name,email,programs,program_names')
+        self.assertEqual(len(result.output.splitlines()), 5)
+
+
+class ResponseCacheTestCase(APITestCase):
+    def test_conditional_get(self):
+        self.seed_clients(0, programs=['HIV'])
+        first = self.app.get('/api/programs', headers=self.headers)
+        etag = first.headers['ETag']
+        again = self.app.get('/api/programs', headers={**self.headers, 'If-None-Match': etag})
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.data, b'')
+
+        self.app.post('/api/programs', json={'name': 'TB'}, headers=self.headers)
+        changed = self.app.get('/api/programs', headers={**self.headers, 'If-None-Match': etag})
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual([p['name'] for p in changed.get_json()], ['HIV', 'TB'])
+
+    def test_program_delete_invalidates_client_listing(self):
+        self.seed_clients(1, programs=['HIV'])
+        first = self.app.get('/api/clients', headers=self.headers).get_json()
+        self.assertEqual(len(first['clients'][0]['programs']), 1)
+        program_id = first['clients'][0]['programs'][0]['id']
+        self.app.delete(f'/api/programs/{program_id}', headers=self.headers)
+        after = self.app.get('/api/clients', headers=self.headers).get_json()
+        self.assertEqual(after['clients'][0]['programs'], [])
+
+    def test_memory_cache_evicts_lru_and_expired(self):
+        now = [0]
+        cache = MemoryCache(max_entries=2, ttl=10, clock=lambda: now[0])
+        cache.set('a', 'k1', 1)
+        cache.set('a', 'k2', 2)
+        cache.get('k1')
+        cache.set('b', 'k3', 3)
+        self.assertEqual((cache.get('k1'), cache.get('k2'), cache.get('k3')), (1, None, 3))
+        now[0] = 10
+        self.assertIsNone(cache.get('k1'))
+
+    def test_sqlite_cache_is_shared(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'cache.db')
+            worker_a, worker_b = SQLiteCache(path), SQLiteCache(path)
+            worker_a.set('clients', 'k', ('etag', b'body', 'application/json'))
+            self.assertEqual(worker_b.get('k'), ('etag', b'body', 'application/json'))
+            worker_b.invalidate('clients')
+            self.assertIsNone(worker_a.get('k'))
+
+    def test_sqlite_cache_evicts_least_recently_used(self):
+        now = [0]
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = SQLiteCache(os.path.join(tmp, 'cache.db'), max_entries=2, clock=lambda: now[0])
+            for key in ('k1', 'k2'):
+                now[0] += 1
+                cache.set('a', key, ('etag', key.encode(), 'text/plain'))
+            now[0] += 1
+            cache.get('k1')
+            now[0] += 1
+            cache.set('a', 'k3', ('etag', b'k3', 'text/plain'))
+            self.assertEqual([cache.get(k) is not None for k in ('k1', 'k2', 'k3')], [True, False, True])
+
+    def test_sqlite_cache_hits_skip_recent_access_writes(self):
+        now = [100.0]
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = SQLiteCache(os.path.join(tmp, 'cache.db'), clock=lambda: now[0])
+            cache.set('a', 'k', ('etag', b'body', 'text/plain'))
+            accessed = lambda: cache.connection.execute(
+                "SELECT accessed FROM response_cache").fetchone()[0]
+            now[0] += 0.5
+            cache.get('k')
+            self.assertEqual(accessed(), 100.0)
+            now[0] += 0.5
+            cache.get('k')
+            self.assertEqual(accessed(), 101.0)
+
+    def test_sqlite_cache_errors_fall_back_to_the_database(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = SQLiteCache(os.path.join(tmp, 'cache.db'))
+            broken = mock.MagicMock(**{'execute.side_effect': sqlite3.OperationalError('locked')})
+            with mock.patch.object(SQLiteCache, 'connection', broken), \
+                    self.assertLogs('cache', 'WARNING'):
+                self.assertIsNone(cache.get('k'))
+                self.assertFalse(cache.set('a', 'k', ('etag', b'body', 'text/plain'),
+                                           cache.generation('a')))
+                cache.invalidate('a')
+
+    def test_stale_render_is_not_stored(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for cache in (MemoryCache(), SQLiteCache(os.path.join(tmp, 'cache.db'))):
+                generation = cache.generation('clients')
+                cache.invalidate('clients')  # A write lands while the old state renders
+                self.assertFalse(cache.set('clients', 'k', ('etag', b'old', 'text/plain'), generation))
+                self.assertIsNone(cache.get('k'))
+                self.assertTrue(cache.set('clients', 'k', ('etag', b'new', 'text/plain'),
+                                          cache.generation('clients')))
+
+    def test_write_during_render_skips_the_cache(self):
+        def page_args_then_write(stream):
+            app.extensions['response_cache'].invalidate('clients')
+            return 0, 100
+        with mock.patch('app.get_page_args', side_effect=page_args_then_write):
+            self.assertEqual(self.app.get('/api/clients', headers=self.headers).status_code, 200)
+        self.assertEqual(len(app.extensions['response_cache'].entries), 0)
+
+
+class MetricsTestCase(APITestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.clear()
+
+    def get(self, url):
+        with self.app.get(url, headers=self.headers) as response:
+            return response
+
+    def test_listing_statement_count_does_not_grow_with_clients(self):
+        self.seed_clients(30, programs=['HIV', 'TB'])
+        self.get('/api/clients?limit=25')
+        body = self.get('/metrics').get_data(as_text=True)
+        self.assertIn('http_requests_total{route="/api/clients",method="GET",status="200"} 1', body)
+        # One query for the page of clients and one for all of their programs
+        self.assertIn('http_request_sql_statements_sum{route="/api/clients",method="GET"} 2', body)
+
+    def test_server_timing_header(self):
+        app.config['SERVER_TIMING'] = True
+        try:
+            response = self.get('/api/programs')
+        finally:
+            app.config['SERVER_TIMING'] = None
+        self.assertIn('db;dur=', response.headers['Server-Timing'])
+        self.assertNotIn('Server-Timing', self.get('/api/programs').headers)
+
+    def test_slow_query_log(self):
+        app.config['SLOW_QUERY_MS'] = 0
+        try:
+            with self.assertLogs(app.logger, 'WARNING') as logs:
+                self.get('/api/programs')
+        finally:
+            app.config['SLOW_QUERY_MS'] = 100
+        self.assertTrue(any('Slow query' in line for line in logs.output))
+
+    def test_sqlite_metrics_add_up_across_workers(self):
+        observations = [('/api/clients', 'GET', 200, 0.02, 2, 0.001, 900),
+                        ('/api/clients', 'GET', 200, 0.3, 3, 0.1, None),
+                        ('/api/programs', 'POST', 201, 0.004, 1, 0.0005, 40)]
+        local = Metrics()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'metrics.db')
+            workers = [SQLiteMetrics(path), SQLiteMetrics(path)]
+            for i, observation in enumerate(observations):
+                local.observe_request(*observation)
+                workers[i % 2].observe_request(*observation)
+            # Worker 1's request is still in its batch until it flushes
+            self.assertIn('http_requests_total{route="/api/clients",method="GET",status="200"} 1\n',
+                          workers[0].render())
+            workers[1].flush()
+            self.assertEqual(workers[0].render(), local.render())
+            workers[1].clear()
+            self.assertEqual(workers[0].render(), Metrics().render())
+
+    def test_sqlite_metrics_flush_periodically_and_drop_failed_batches(self):
+        now = [0]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'metrics.db')
+            worker, scraper = SQLiteMetrics(path, clock=lambda: now[0]), SQLiteMetrics(path)
+            worker.observe_request('/api/programs', 'GET', 200, 0.01, 1, 0.001, 10)
+            self.assertNotIn('/api/programs', scraper.render())
+            now[0] += SQLiteMetrics.FLUSH_INTERVAL
+            worker.observe_request('/api/programs', 'GET', 200, 0.01, 1, 0.001, 10)
+            self.assertIn('http_requests_total{route="/api/programs",method="GET",status="200"} 2',
+                          scraper.render())
+            broken = mock.MagicMock(**{'execute.side_effect': sqlite3.OperationalError('locked')})
+            now[0] += SQLiteMetrics.FLUSH_INTERVAL
+            with mock.patch.object(SQLiteMetrics, 'connection', broken), \
+                    self.assertLogs('metrics', 'WARNING'):
+                worker.observe_request('/api/programs', 'GET', 200, 0.01, 1, 0.001, 10)
+            self.assertIn('status="200"} 2', worker.render())
+
+    def test_slow_request_log_omits_query_string(self):
+        app.config['SLOW_REQUEST_MS'] = 0
+        try:
+            with self.assertLogs(app.logger, 'WARNING') as logs:
+                self.get('/api/clients/search?query=mary.jones@example.com')
+        finally:
+            app.config['SLOW_REQUEST_MS'] = 500
+        slow = [line for line in logs.output if 'Slow request' in line]
+        self.assertTrue(slow[0].endswith('GET /api/clients/search'))
+        self.assertNotIn('mary', ' '.join(logs.output))
+
+
+class BenchmarkTestCase(APITestCase):
+    def test_percentile_and_compare(self):
+        values = list(range(1, 101))
+        self.assertEqual((percentile(values, 50), percentile(values, 95), percentile(values, 99)),
+                         (50, 95, 99))
+        baseline = {"results": {"a": {"p95_ms": 10, "throughput_rps": 100, "requests": 200}}}
+        faster = {"results": {"a": {"p95_ms": 9, "throughput_rps": 110, "requests": 200}}}
+        slower = {"results": {"a": {"p95_ms": 13, "throughput_rps": 70, "requests": 200}}}
+        self.assertEqual(compare(faster, baseline, 0.2), [])
+        self.assertEqual(len(compare(slower, baseline, 0.2)), 2)
+        slower["results"]["a"]["requests"] = 4  # Too few samples for a meaningful p95
+        self.assertEqual(undersampled(slower, baseline), ["a"])
+        self.assertEqual(compare(slower, baseline, 0.2), [])
+
+    def test_baseline_settings_must_match(self):
+        meta = {"clients": 1000, "programs": 5, "enrollments": 3, "threads": 1, "warm_cache": False}
+        self.assertEqual(meta_mismatches(meta, dict(meta, iterations=50)), [])
+        mismatches = meta_mismatches(dict(meta, threads=4), meta)
+        self.assertEqual(len(mismatches), 1)
+        self.assertIn('threads', mismatches[0])
+
+    def test_template_is_reseeded_when_schema_changes(self):
+        fingerprint = schema_fingerprint(db)
+        self.assertEqual(schema_fingerprint(db), fingerprint)
+        with tempfile.TemporaryDirectory() as tmp:
+            template = os.path.join(tmp, 'benchmark.db')
+            volumes = {"clients": 1, "schema": fingerprint}
+            with open(template, 'w'), open(template + '.json', 'w') as f:
+                json.dump(volumes, f)
+            self.assertTrue(load_template(template, volumes)[1])
+            self.assertFalse(load_template(template, {**volumes, "schema": "older"})[1])
+
+    def test_every_scenario_runs_on_seeded_data(self):
+        app.config['API_KEYS'] = ['benchmark-key']
+        rng = random.Random(1)
+        seed(db, clients=50, programs=5, enrollments=2, rng=rng)
+        self.assertEqual(db.session.query(client_program).count(), 100)
+        for scenario in build_scenarios(50, 5, rng):
+            summary = run_scenario(app, scenario, iterations=4, threads=1, warm_cache=False)
+            self.assertGreaterEqual(summary['requests'], 1, scenario[0])
+
+
+class EnrollmentTestCase(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.seed_clients(6, programs=['HIV'])
+        self.hiv = AppProgram.query.filter_by(name='HIV').one().id
+        campaign = AppProgram(name='Campaign')
+        db.session.add(campaign)
+        db.session.commit()
+        self.campaign = campaign.id
+        self.ids = [c.id for c in AppClient.query.order_by(AppClient.id)]
+
+    def enrolled(self, program_id):
+        return sorted(cid for cid, pid in db.session.execute(db.select(client_program))
+                      if pid == program_id)
+
+    def send(self, method, url, body):
+        return self.app.open(url, method=method, json=body, headers=self.headers)
+
+    def test_enroll_ids_is_idempotent(self):
+        url = f'/api/programs/{self.campaign}/enrollments'
+        result = self.send('POST', url, {'client_ids': self.ids[:3] + [999]}).get_json()
+        self.assertEqual(result['enrolled'], 3)
+        result = self.send('POST', url, {'client_ids': self.ids[:4]}).get_json()
+        self.assertEqual(result['enrolled'], 1)
+        self.assertEqual(self.enrolled(self.campaign), self.ids[:4])
+
+        result = self.send('DELETE', url, {'client_ids': self.ids[:2]}).get_json()
+        self.assertEqual(result['removed'], 2)
+        self.assertEqual(self.enrolled(self.campaign), self.ids[2:4])
+        self.assertEqual(self.enrolled(self.hiv), self.ids)
+
+    def test_enroll_by_search_filter_in_chunks(self):
+        app.config['ENROLLMENT_ID_CHUNK'] = 2
+        try:
+            url = f'/api/programs/{self.campaign}/enrollments'
+            self.assertEqual(self.send('POST', url, {'client_ids': self.ids}).get_json()['enrolled'], 6)
+            self.send('DELETE', url, {'query': 'client'})
+        finally:
+            app.config['ENROLLMENT_ID_CHUNK'] = 5000
+        self.assertEqual(self.enrolled(self.campaign), [])
+        self.send('POST', url, {'query': 'Client 1'})
+        self.assertEqual(self.enrolled(self.campaign), [self.ids[1]])
+
+    def test_bad_enrollment_requests(self):
+        url = f'/api/programs/{self.campaign}/enrollments'
+        self.assertEqual(self.send('POST', url, {}).status_code, 400)
+        self.assertEqual(self.send('POST', url, {'client_ids': [1], 'query': 'x'}).status_code, 400)
+        self.assertEqual(self.send('POST', url, {'client_ids': 'all'}).status_code, 400)
+        self.assertEqual(self.send('POST', url, {'client_ids': [True]}).status_code, 400)
+        self.assertEqual(self.send('POST', '/api/programs/999/enrollments',
+                                   {'client_ids': [1]}).status_code, 404)
+
+    def test_replace_client_programs(self):
+        url = f'/api/clients/{self.ids[0]}/programs'
+        result = self.send('PUT', url, {'programs': [self.campaign]}).get_json()
+        self.assertEqual((result['added'], result['removed']), (1, 1))
+        self.assertEqual(self.enrolled(self.campaign), [self.ids[0]])
+        self.assertNotIn(self.ids[0], self.enrolled(self.hiv))
+        result = self.send('PUT', url, {'programs': []}).get_json()
+        self.assertEqual((result['added'], result['removed']), (0, 1))
+        self.assertEqual(self.send('PUT', url, {'programs': [999]}).status_code, 400)
+        self.assertEqual(self.send('PUT', url, {'programs': [True]}).status_code, 400)
+        self.assertEqual(self.send('PUT', '/api/clients/999/programs', {'programs': []}).status_code, 404)
+
+
+class EnrollmentStatsTestCase(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.seed_clients(4, programs=['HIV', 'TB'])
+        self.hiv, self.tb = [p.id for p in AppProgram.query.order_by(AppProgram.id)]
+        self.ids = [c.id for c in AppClient.query.order_by(AppClient.id)]
+
+    def stats(self, query=''):
+        return self.app.get(f'/api/stats/programs{query}', headers=self.headers).get_json()
+
+    def counts(self):
+        stats = self.stats()
+        return ({p['id']: p['clients'] for p in stats['programs']},
+                {d['programs']: d['clients'] for d in stats['programs_per_client']})
+
+    def test_counters_follow_every_write(self):
+        self.assertEqual(self.counts(), ({self.hiv: 4, self.tb: 4}, {2: 4}))
+
+        self.app.post('/api/clients', json={'name': 'New', 'email': 'new@example.com',
+                                            'programs': [self.tb]}, headers=self.headers)
+        self.assertEqual(self.counts(), ({self.hiv: 4, self.tb: 5}, {1: 1, 2: 4}))
+
+        self.app.put(f'/api/clients/{self.ids[0]}/programs', json={'programs': []},
+                     headers=self.headers)
+        self.app.delete(f'/api/programs/{self.hiv}/enrollments',
+                        json={'client_ids': self.ids[1:3]}, headers=self.headers)
+        self.app.delete(f'/api/clients/{self.ids[3]}', headers=self.headers)
+        self.assertEqual(self.counts(), ({self.hiv: 0, self.tb: 3}, {0: 1, 1: 3}))
+
+        self.app.post('/api/clients/bulk', data='{"name": "Bulk", "email": "bulk@example.com"}\n',
+                      content_type='application/x-ndjson', headers=self.headers)
+        self.app.delete(f'/api/programs/{self.tb}', headers=self.headers)
+        self.assertEqual(self.counts(), ({self.hiv: 0}, {0: 5}))
+        self.assertEqual(db.session.execute(db.select(db.func.count()).select_from(client_program)).scalar(), 0)
+
+    def test_new_enrollment_buckets(self):
+        today = datetime.now(timezone.utc).date()  # Triggers stamp enrollments in UTC
+        by_bucket = {'day': today.isoformat(), 'month': today.isoformat()[:7],
+                     'week': '{0}-W{1:02d}'.format(*today.isocalendar())}
+        for bucket, period in by_bucket.items():
+            result = self.stats(f'?bucket={bucket}')['new_enrollments']
+            self.assertEqual(result, [{'program_id': self.hiv, 'period': period, 'enrolled': 4},
+                                      {'program_id': self.tb, 'period': period, 'enrolled': 4}])
+        tomorrow = (today + timedelta(days=1)).isoformat()
+        self.assertEqual(self.stats(f'?bucket=day&since={tomorrow}')['new_enrollments'], [])
+        self.assertEqual(self.app.get('/api/stats/programs?bucket=year', headers=self.headers).status_code, 400)
+        self.assertEqual(self.app.get('/api/stats/programs?bucket=day&since=soon',
+                                      headers=self.headers).status_code, 400)
+
+    def test_recompute_repairs_drift(self):
+        db.session.execute(db.text('UPDATE program_enrollment_stats SET clients = 99'))
+        db.session.execute(db.text('DELETE FROM client_program_distribution'))
+        db.session.commit()
+        result = app.test_cli_runner().invoke(args=['recompute-enrollment-stats'])
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(self.counts(), ({self.hiv: 4, self.tb: 4}, {2: 4}))
+
+    def test_recompute_reports_orphans_and_prunes_only_when_asked(self):
+        # A raw delete leaves the client's enrollments behind (SQLite does not enforce the FK)
+        db.session.execute(db.delete(AppClient).where(AppClient.id == self.ids[0]))
+        db.session.commit()
+        enrollments = lambda: db.session.execute(
+            db.select(db.func.count()).select_from(client_program)).scalar()
+        runner = app.test_cli_runner()
+
+        result = runner.invoke(args=['recompute-enrollment-stats'])
+        self.assertIn('2 orphaned enrollments left out', result.output)
+        self.assertEqual(enrollments(), 8)
+        self.assertEqual(self.counts(), ({self.hiv: 3, self.tb: 3}, {2: 3}))
+
+        result = runner.invoke(args=['recompute-enrollment-stats', '--prune-orphans'])
+        self.assertIn('Removed 2 orphaned enrollments', result.output)
+        self.assertEqual(enrollments(), 6)
+        self.assertEqual(self.counts(), ({self.hiv: 3, self.tb: 3}, {2: 3}))
+
+
+class ProductionProfileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        path = lambda name: 'sqlite:///' + os.path.join(self.tmp.name, name)
+        self.app = create_app('production', TESTING=True, API_KEYS=['test-key'],
+                              SQLALCHEMY_DATABASE_URI=path('health.db'),
+                              RATELIMIT_STORAGE_URI=path('ratelimit.db'),
+                              RESPONSE_CACHE_URI=path('cache.db'),
+                              METRICS_URI=path('metrics.db'))
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.engine.dispose()
+        self.tmp.cleanup()
+
+    def test_sqlite_pragmas_and_pool(self):
+        with self.app.app_context():
+            db.create_all()
+            self.assertEqual(db.session.execute(db.text('PRAGMA journal_mode')).scalar(), 'wal')
+            self.assertEqual(db.session.execute(db.text('PRAGMA busy_timeout')).scalar(), 5000)
+            self.assertEqual(db.engine.pool.size(), 5)
+        self.assertIsInstance(self.app.extensions['response_cache'], SQLiteCache)
+        self.assertIsInstance(self.app.extensions['metrics'], SQLiteMetrics)
+
+    def test_relative_store_paths_live_in_the_instance_folder(self):
+        with tempfile.TemporaryDirectory() as tmp, \
+                mock.patch.object(Flask, 'auto_find_instance_path', return_value=tmp):
+            built = create_app(TESTING=True, SQLALCHEMY_DATABASE_URI='sqlite://',
+                               RATELIMIT_STORAGE_URI='sqlite:///ratelimit.db',
+                               RESPONSE_CACHE_URI='sqlite:///response_cache.db',
+                               METRICS_URI=self.app.config['METRICS_URI'])
+            self.assertEqual(built.config['RATELIMIT_STORAGE_URI'],
+                             'sqlite:///' + os.path.join(tmp, 'ratelimit.db'))
+            self.assertEqual(built.extensions['response_cache'].path,
+                             os.path.join(tmp, 'response_cache.db'))
+            self.assertEqual(built.config['METRICS_URI'], self.app.config['METRICS_URI'])
+
+    def test_apps_keep_their_own_limiter(self):
+        self.assertIsInstance(self.app.extensions['rate_limiter'].storage, SQLiteStorage)
+        self.assertIsInstance(limiter.storage, MemoryStorage)
+        client = self.app.test_client()
+        statuses = [client.post('/api/clients', json={}, headers={'X-API-KEY': 'test-key'}).status_code
+                    for _ in range(11)]
+        self.assertEqual(statuses[-1], 429)
+
+    def test_import_does_not_build_an_app(self):
+        script = "import app, sys; sys.exit('app' in vars(app))"
+        self.assertEqual(subprocess.run([sys.executable, '-c', script],
+                                        cwd=os.path.dirname(os.path.dirname(__file__))).returncode, 0)
+
+    def test_rate_limits_are_shared_between_workers(self):
+        uri = self.app.config['RATELIMIT_STORAGE_URI']
+        worker_a, worker_b = SQLiteStorage(uri), SQLiteStorage(uri)
+        self.assertEqual(worker_a.incr('key', 60), 1)
+        self.assertEqual(worker_b.incr('key', 60), 2)
+        self.assertEqual(worker_a.get('key'), 2)
+        worker_b.clear('key')
+        self.assertEqual(worker_a.get('key'), 0)
+        self.assertEqual(worker_a.incr('expired', -1), 1)
+        self.assertEqual(worker_b.incr('expired', 60), 1)  # A lapsed window starts over
+
+
 if __name__ == '__main__':
     unittest.main()